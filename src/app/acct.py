@@ -0,0 +1,214 @@
+import numpy as np
+import os
+import re
+import warnings
+
+from pathlib import Path
+
+# Columns of slurm_acct.out read by read_acct, the others are skipped
+DATE_COLUMNS = ['Submit', 'Eligible', 'Start', 'End']
+INT_COLUMNS = ['NCPUS', 'NNodes']
+# The wait time needs these, the other columns are optional (NaN or -1 when missing)
+REQUIRED_COLUMNS = ['Eligible', 'Start']
+
+def epoch(values:list[str]) -> np.ndarray:
+    '''
+    Seconds since the epoch of sacct timestamps (%Y-%m-%dT%H:%M:%S), NaN for Unknown/None values
+    '''
+    values = [value if value[:1].isdigit() else 'NaT' for value in values]
+    dates = np.array(values, dtype='datetime64[s]')
+    seconds = dates.astype(np.int64).astype(np.float64)
+    seconds[np.isnat(dates)] = np.nan
+    return seconds
+
+def limit_seconds(value:str) -> float:
+    '''
+    Seconds of a sacct time limit ([D-]HH:MM:SS, MM:SS or MM), NaN for UNLIMITED and the like
+    '''
+    days = 0
+    if '-' in value:
+        days, value = value.split('-', 1)
+    try:
+        parts = [int(part) for part in value.split(':')]
+        days = int(days)
+    except ValueError:
+        return np.nan
+    if len(parts) == 1:
+        parts = [0, parts[0], 0]
+    elif len(parts) == 2:
+        parts = [0] + parts
+    return days * 86400 + parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+class Acct:
+    '''
+    Class Acct: job metrics of a slurm_acct.out, one array entry for every job.
+    Times are float64 epoch seconds (NaN when unknown), timelimit is in seconds.
+    Columns missing from the file are NaN (times, timelimit) or -1 (ncpus, nnodes).
+    '''
+
+    def __init__(self, submit:np.ndarray, eligible:np.ndarray, start:np.ndarray, end:np.ndarray,
+                 timelimit:np.ndarray, ncpus:np.ndarray, nnodes:np.ndarray):
+        self.submit = submit
+        self.eligible = eligible
+        self.start = start
+        self.end = end
+        self.timelimit = timelimit
+        self.ncpus = ncpus
+        self.nnodes = nnodes
+
+    def wait(self) -> np.ndarray:
+        return self.start - self.eligible
+
+    def runtime(self) -> np.ndarray:
+        return self.end - self.start
+
+    def __len__(self) -> int:
+        return len(self.submit)
+
+def read_acct(loc:str|Path) -> Acct:
+    """
+    Parse a pipe-separated slurm_acct.out, as written by sacct -P.
+
+    Args:
+        loc (str | Path): slurm_acct.out location
+
+    Returns:
+        Acct: the job times, time limits and allocated resources
+    """
+    with open(loc, mode='r') as f:
+        lines = f.read().splitlines()
+    header = lines[0].split('|')
+    rows = [line.split('|') for line in lines[1:] if line]
+    columns = list(zip(*rows)) if len(rows) > 0 else [()] * len(header)
+
+    missing = [name for name in REQUIRED_COLUMNS if name not in header]
+    if len(missing) > 0:
+        raise ValueError(f'{loc}: missing columns {", ".join(missing)}')
+
+    def column(name):
+        return columns[header.index(name)] if name in header else None
+
+    def dates(name):
+        values = column(name)
+        return epoch(values) if values is not None else np.full(len(rows), np.nan)
+
+    def ints(name):
+        values = column(name)
+        return np.array(values, dtype=np.int64) if values is not None else np.full(len(rows), -1, dtype=np.int64)
+
+    submit, eligible, start, end = [dates(name) for name in DATE_COLUMNS]
+    values = column('Timelimit')
+    if values is not None:
+        # Few distinct limits appear in a workload, each one is parsed once
+        limits = {value: limit_seconds(value) for value in set(values)}
+        timelimit = np.array([limits[value] for value in values], dtype=np.float64)
+    else:
+        timelimit = np.full(len(rows), np.nan)
+    ncpus, nnodes = [ints(name) for name in INT_COLUMNS]
+    return Acct(submit, eligible, start, end, timelimit, ncpus, nnodes)
+
+def mean_wait(loc:str|Path) -> float:
+    """
+    Mean wait time (Start - Eligible) in seconds of the jobs in a slurm_acct.out.
+    Jobs without a wait (never started, Unknown times) are skipped with a warning.
+
+    Args:
+        loc (str | Path): slurm_acct.out location
+
+    Raises:
+        ValueError: no job of the file has a wait time
+
+    Returns:
+        float: mean wait in seconds
+    """
+    wait = read_acct(loc).wait()
+    known = ~np.isnan(wait)
+    dropped = len(wait) - int(known.sum())
+    if dropped == len(wait):
+        raise ValueError(f'{loc}: no job with a wait time ({len(wait)} jobs)')
+    if dropped > 0:
+        warnings.warn(f'{loc}: {dropped} of {len(wait)} jobs without a wait time skipped')
+    return float(wait[known].mean())
+
+# key=value fields of a jobcomp/filetxt record (log/jobcomp.log)
+JOBCOMP_RX = re.compile(r'(\w+)=(\S*)')
+
+class WaitTail:
+    '''
+    Class WaitTail: incremental reader of the job records written while a simulation runs,
+    log/jobcomp.log (key=value lines) or a slurm_acct.out (sacct -P lines).
+
+    Every poll reads only the bytes appended since the previous one, a record is counted
+    once its line is complete. With @total jobs in the workload the final mean wait is at
+    least lower_bound: the known waits are final and every other job waits 0 or more.
+    '''
+
+    def __init__(self, path:str|Path, total:int):
+        self.path = path if isinstance(path, Path) else Path(path)
+        self.total = total
+        self.reset()
+
+    def reset(self):
+        self.offset = 0
+        self.partial = b''
+        self.header = None
+        self.count = 0
+        self.wait_sum = 0.
+
+    def poll(self) -> int:
+        """
+        Read the new records.
+
+        Returns:
+            int: number of new jobs
+        """
+        try:
+            with open(self.path, mode='rb') as f:
+                if os.fstat(f.fileno()).st_size < self.offset:
+                    # Rewritten from scratch (e.g. by the next run of the env)
+                    self.reset()
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+        self.offset += len(data)
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        start, eligible = [], []
+        for line in lines:
+            line = line.decode().rstrip('\r')
+            if '|' in line:
+                fields = line.split('|')
+                if self.header is None:
+                    self.header = fields
+                    continue
+                if len(fields) != len(self.header):
+                    continue
+                start.append(fields[self.header.index('Start')])
+                eligible.append(fields[self.header.index('Eligible')])
+            elif line:
+                fields = dict(JOBCOMP_RX.findall(line))
+                start.append(fields.get('StartTime', ''))
+                eligible.append(fields.get('EligibleTime', fields.get('SubmitTime', '')))
+        if len(start) == 0:
+            return 0
+        wait = epoch(start) - epoch(eligible)
+        wait = wait[~np.isnan(wait)]
+        self.count += len(wait)
+        self.wait_sum += float(wait.sum())
+        return len(wait)
+
+    def mean(self) -> float:
+        '''
+        Mean wait in seconds of the jobs read so far, NaN before the first one
+        '''
+        return self.wait_sum / self.count if self.count > 0 else np.nan
+
+    def lower_bound(self) -> float:
+        '''
+        Lower bound in seconds of the final mean wait of the @total jobs
+        '''
+        return self.wait_sum / max(self.total, 1)
+
+    def done(self) -> bool:
+        return self.count >= self.total
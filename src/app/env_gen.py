@@ -7,7 +7,7 @@ from slurm_load.job import JobGenerator
 
 from slurm_load.workload import WorkLoad
 
-import numpy.random as rnd
+import numpy as np
 
 class SlurmEnvGen:
     """
@@ -40,16 +40,19 @@ class SlurmEnvGen:
             max_long_jon: Maximum time for long jobs in hour. default 24.
             max_short_jon: Maximum time for long jobs in minute. Default 60.
             min_mem: min memory required for jobs. Default is 1000.
+
+        rng: random stream shared by all the generators. Default is a fresh one.
     """
 
-    def __init__(self, clust_size=6, **args):
+    def __init__(self, clust_size=6, rng:np.random.Generator=None, **args):
         self.clust_size = clust_size
-        self.node_gen = NodeGenerator(**args)
-        self.topo_gen = TopologyGenerator(node_gen=self.node_gen, **args)
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.node_gen = NodeGenerator(rng=self.rng, **args)
+        self.topo_gen = TopologyGenerator(node_gen=self.node_gen, rng=self.rng, **args)
         self.generate_topology()
-        self.user_gen = UserGenerator(**args)
+        self.user_gen = UserGenerator(rng=self.rng, **args)
         self.generate_users()
-        self.job_generator = JobGenerator(topology=self.topology, **args)
+        self.job_generator = JobGenerator(topology=self.topology, rng=self.rng, **args)
         self.workload = WorkLoad(self.users[1:], self.accounts, self.job_generator)
 
 
@@ -63,10 +66,10 @@ class SlurmEnvGen:
         self.users = users
         self.num_group = num_group
 
-        account_n = rnd.randint(1, len(users) + 1)
+        account_n = self.rng.integers(1, len(users) + 1)
         accounts = {}
         for i, user in enumerate(users[1:]):
-            accounts[user.usr] = f"account{rnd.randint(1, account_n + 1)}"
+            accounts[user.usr] = f"account{self.rng.integers(1, account_n + 1)}"
         
         self.accounts = accounts
 
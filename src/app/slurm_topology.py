@@ -1,15 +1,16 @@
 from slurm_topo.topology import TopologyGenerator, Topology, TopologyPrinter
 from slurm_topo.node import NodeGenerator, Node
 from slurm_load.user import UserGenerator, User
-from slurm_load.utils import print_users_sim
+from slurm_load.utils import print_users_sim, print_events
 from slurm_load.job import JobGenerator
 from slurm_load.workload import WorkLoad
 
 from pathlib import Path
 
 from app.utils import eprint, load_template
+from slurm_sim.simulator import DEF_MEM_PER_CPU
 
-import numpy.random as rnd
+import numpy as np
 
 import shutil
 import sys
@@ -32,7 +33,7 @@ def print_gres(filename, nodes:list[Node]):
 
 def print_slurm_conf(filename, nodes:list[Node], path='lol', name='micro'):
     with open(filename, 'wb') as f:
-        SL_CONF_TEMP.stream(f, nodes=nodes, path=path, name=name, min_mem=500)
+        SL_CONF_TEMP.stream(f, nodes=nodes, path=path, name=name, min_mem=DEF_MEM_PER_CPU)
 
 def print_acc_manager(filename, users:dict, max_job=1000):
     with open(filename, 'wb') as f:
@@ -79,14 +80,17 @@ class TopologyApp:
         printer = TopologyPrinter()
         printer.print_topology(f"{self.etc_path.absolute()}/topology.conf", topology.topo)
 
-    def print_workload(self, jobs):
-        with open(self.workload_path / 'first_job.events', 'w') as f:
-            for td, job in jobs:
-                f.write(f"-dt {td} -e submit_batch_job | {job}\n")
-    def print_start(self):
+    def print_workload(self, jobs, zero=False):
+        print_events(self.workload_path / 'first_job.events', jobs, zero)
+
+    def print_start(self, rng:np.random.Generator=None):
+        '''
+        Write start.sh, its start delay is drawn from @rng (a fresh stream by default)
+        '''
+        rng = np.random.default_rng() if rng is None else rng
         filename = (self.etc_path.absolute().parent / 'start.sh').as_posix()
         with open(filename, 'wb') as f:
-            dtstart = rnd.randint(30,150)
+            dtstart = int(rng.integers(30, 150))
             START.stream(f, dtstart=dtstart)
         perm = os.stat(filename)
         os.chmod(filename, perm.st_mode | stat.S_IEXEC)
@@ -125,10 +129,11 @@ if __name__ == '__main__':
     users.sort()
     print_users_sim(f"{etc_dir.absolute()}/users.sim", users)
 
-    account_n = rnd.randint(1, len(users) + 1)
+    rng = np.random.default_rng()
+    account_n = rng.integers(1, len(users) + 1)
     accounts = {}
     for i, user in enumerate(users[1:]):
-        accounts[user.usr] = f"account{rnd.randint(1, account_n + 1)}"
+        accounts[user.usr] = f"account{rng.integers(1, account_n + 1)}"
     
     print_acc_manager(f"{etc_dir.absolute()}/sacctmgr.script", accounts)
     print_slurmDB(f"{etc_dir.absolute()}/slurmdbd.conf", path=p.as_posix())
@@ -137,9 +142,6 @@ if __name__ == '__main__':
     shutil.copy('templates/slurm.key', (etc_dir / 'slurm.key').as_posix())
     job_gen = JobGenerator(topology=topo)
     workload_gen = WorkLoad(users[1:], accounts, job_gen)
-    jobs = workload_gen.generate_workload(50)
-    with open(workload_dir / 'first_job.events', 'w') as f:
-        for td, job in jobs:
-            f.write(f"-dt {td} -e submit_batch_job | {job}\n")
+    print_events(workload_dir / 'first_job.events', workload_gen.iter_workload(50))
 
     sys.exit(0)
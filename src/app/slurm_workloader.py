@@ -1,6 +1,6 @@
 from slurm_load.job import Job, JobGenerator
 from slurm_load.user import User
-from slurm_load.utils import read_users_sim
+from slurm_load.utils import read_users_sim, print_events
 from slurm_load.workload import WorkLoad
 
 from app.utils import read_account, node_extract, topology_extract
@@ -26,10 +26,6 @@ if __name__ == '__main__':
 
     job_gen = JobGenerator(topology=topo)
     workload_gen = WorkLoad(users[1:], accounts, job_gen)
-    jobs = workload_gen.generate_workload(50)
-
-    with open(workload_dir / 'first_job.events', 'w') as f:
-        for td, job in jobs:
-            f.write(f"-dt {td} -e submit_batch_job | {job}\n")
+    print_events(workload_dir / 'first_job.events', workload_gen.iter_workload(50))
 
     sys.exit(0)
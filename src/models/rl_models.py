@@ -4,23 +4,48 @@ from torch.distributions import Normal
 
 MAX_INT = 2**16
 
+# Attention of TransformerLayer: nn.MultiheadAttention, fused scaled dot product,
+# fused over chunks of queries, or pooled through a few learned inducing points
+ATTENTIONS = ('mha', 'sdpa', 'chunked', 'pooled')
+
 class TransformerLayer(nn.Module):
+    '''
+    Class TransformerLayer: self-attention and feed-forward block, both residual.
 
-    def __init__(self, embedded_dim:int=128, num_heads:int=4, dropout:float=0.3, batch_first:bool=True):
+    @attention selects how the jobs attend to each other:
+    - mha: the original nn.MultiheadAttention over the projected inputs
+    - sdpa: a single qkv projection and fused scaled_dot_product_attention, no attention matrix is kept
+    - chunked: sdpa over blocks of @chunk_size queries, the memory grows linearly with the jobs
+    - pooled: @num_inducing learned points attend to the jobs, then the jobs attend to them
+      (induced set attention), linear time and memory
+    '''
+
+    def __init__(self, embedded_dim:int=128, num_heads:int=4, dropout:float=0.3, batch_first:bool=True,
+                 attention:str='mha', chunk_size:int=1024, num_inducing:int=32):
         super().__init__()
+        if attention not in ATTENTIONS:
+            raise ValueError(f'attention must be one of {ATTENTIONS}, not {attention}')
 
         self.embedded_dim = embedded_dim
         self.num_heads = num_heads
         self.dropout = dropout
         self.batch_first = batch_first
+        self.attention = attention
+        self.chunk_size = chunk_size
 
         self.projection = nn.Linear(embedded_dim, embedded_dim * 3)
-        self.attention_layer = nn.MultiheadAttention(
-            embed_dim=embedded_dim,
-            num_heads=num_heads,
-            dropout=dropout,
-            batch_first=batch_first
-        )
+        if self.attention == 'mha':
+            self.attention_layer = nn.MultiheadAttention(
+                embed_dim=embedded_dim,
+                num_heads=num_heads,
+                dropout=dropout,
+                batch_first=batch_first
+            )
+        else:
+            self.out_projection = nn.Linear(embedded_dim, embedded_dim)
+        if self.attention == 'pooled':
+            self.inducing = nn.Parameter(torch.randn(size=(1, num_inducing, embedded_dim)))
+            self.inducing_projection = nn.Linear(embedded_dim, embedded_dim * 2)
         self.attention_norm = nn.LayerNorm(embedded_dim)
         self.ffwd = nn.Sequential(
             nn.Linear(embedded_dim, embedded_dim),
@@ -28,9 +53,35 @@ class TransformerLayer(nn.Module):
             nn.LeakyReLU(),
         )
 
-    def forward(self, x:torch.Tensor) -> torch.Tensor:
+    def heads(self, x:torch.Tensor) -> torch.Tensor:
+        # (N, L, E) -> (N, heads, L, E / heads)
+        return x.unflatten(-1, (self.num_heads, -1)).transpose(1, 2)
+
+    def fused(self, q:torch.Tensor, k:torch.Tensor, v:torch.Tensor, mask:torch.Tensor=None) -> torch.Tensor:
+        dropout = self.dropout if self.training else 0.
+        if self.attention != 'chunked' or q.size(2) <= self.chunk_size:
+            return nn.functional.scaled_dot_product_attention(q, k, v, attn_mask=mask, dropout_p=dropout)
+        return torch.cat([nn.functional.scaled_dot_product_attention(q[:, :, i:i + self.chunk_size], k, v, attn_mask=mask, dropout_p=dropout)
+                          for i in range(0, q.size(2), self.chunk_size)], dim=2)
+
+    def self_attention(self, x:torch.Tensor, mask:torch.Tensor=None) -> torch.Tensor:
         q, k, v = torch.chunk(self.projection.forward(x), 3, dim=-1)
-        x_att, _ = self.attention_layer.forward(q, k, v)
+        if self.attention == 'mha':
+            x_att, _ = self.attention_layer.forward(q, k, v, key_padding_mask=mask, need_weights=False)
+            return x_att
+        # Boolean attn_mask of scaled_dot_product_attention: True where the key takes part
+        keep = None if mask is None else ~mask[:, None, None, :]
+        q, k, v = self.heads(q), self.heads(k), self.heads(v)
+        if self.attention == 'pooled':
+            induced = self.fused(self.heads(self.inducing.expand(x.size(0), -1, -1)), k, v, keep)
+            k, v = torch.chunk(self.inducing_projection.forward(induced.transpose(1, 2).flatten(2)), 2, dim=-1)
+            x_att = self.fused(q, self.heads(k), self.heads(v))
+        else:
+            x_att = self.fused(q, k, v, keep)
+        return self.out_projection(x_att.transpose(1, 2).flatten(2))
+
+    def forward(self, x:torch.Tensor, mask:torch.Tensor=None) -> torch.Tensor:
+        x_att = self.self_attention(x, mask)
         x_att = self.attention_norm(x_att)
         x = x + x_att
         x_ffwd = self.ffwd(x)
@@ -38,10 +89,12 @@ class TransformerLayer(nn.Module):
 
 class QNet(nn.Module):
     '''
-    Class QNet: First implementation of Critic Net
+    Class QNet: First implementation of Critic Net.
+    For long workloads (thousands of jobs) use attention='chunked' or 'pooled', see TransformerLayer
     '''
 
-    def __init__(self, input_dim:int, output_dim:int, depth:int=5, embedded_dim:int=128, num_heads:int=4, batch_first:bool=True):
+    def __init__(self, input_dim:int, output_dim:int, depth:int=5, embedded_dim:int=128, num_heads:int=4, batch_first:bool=True,
+                 attention:str='mha', chunk_size:int=1024, num_inducing:int=32):
         super(QNet, self).__init__()
         self.input_dim = input_dim
         self.output_dim = output_dim
@@ -49,6 +102,7 @@ class QNet(nn.Module):
         self.num_heads = num_heads
         self.depth = depth
         self.batch_first = batch_first
+        self.attention = attention
         self.cls = nn.Parameter(torch.randn(size=(1, 1, self.embedded_dim)))
 
         self.dimensioner = nn.Sequential(nn.LayerNorm(self.input_dim), nn.Linear(self.input_dim, self.embedded_dim))
@@ -56,21 +110,38 @@ class QNet(nn.Module):
             embedded_dim=self.embedded_dim,
             num_heads=self.num_heads,
             dropout=0.3,
-            batch_first=self.batch_first
+            batch_first=self.batch_first,
+            attention=attention,
+            chunk_size=chunk_size,
+            num_inducing=num_inducing
         ) for _ in range(self.depth)])
         self.classifier = nn.Linear(self.embedded_dim, self.output_dim)
 
-    def forward(self, x:torch.Tensor) -> torch.Tensor:
+    def forward(self, x:torch.Tensor, mask:torch.Tensor=None) -> torch.Tensor:
+        '''
+        @x (N, L, input_dim) workloads, @mask (N, L) True on the padded jobs (see train.data.pad_collate)
+        '''
         N = x.size(0)
         x = self.dimensioner(x)
         x = torch.cat([torch.tile(self.cls, (N, 1, 1)), x], dim=1)
+        if mask is not None:
+            # The cls token is never padding
+            mask = torch.cat([torch.zeros((N, 1), dtype=torch.bool, device=mask.device), mask], dim=1)
         for attention in self.attentions:
-            x = attention.forward(x)
+            x = attention.forward(x, mask)
         cls_token = x[:, 0, :]
         return self.classifier(cls_token)
 
 class SlurmNet(nn.Module):
-    def __init__(self, input_dim:int, mid_dim:int, output_dim:int, hidden_dim:int=128, depth_first:int=2, depth_second:int=1, dropout=0.5):
+    '''
+    Class SlurmNet: per job MLP, then a workload level MLP.
+
+    With a @mid_dim every job is reduced to a scalar and the workload is the vector of
+    these mid_dim scalars: shorter (or padded) workloads are filled with zeros, longer
+    ones are not supported. With mid_dim=None the job features are mean pooled over the
+    (unpadded) jobs, any workload length is accepted.
+    '''
+    def __init__(self, input_dim:int, mid_dim:int|None, output_dim:int, hidden_dim:int=128, depth_first:int=2, depth_second:int=1, dropout=0.5):
         super().__init__()
         self.input_dim = input_dim
         self.output_dim = output_dim
@@ -89,15 +160,18 @@ class SlurmNet(nn.Module):
             nn.Dropout(self.drop),
             nn.LeakyReLU(),
         ) for _ in range(depth_first)])
-        self.mid_layer = nn.Sequential(
-            nn.LayerNorm(self.hidden_dim),
-            nn.Linear(self.hidden_dim, 1),
-            nn.LeakyReLU(),
-        )
+        self.mid_layer = None
+        if self.mid_dim is not None:
+            self.mid_layer = nn.Sequential(
+                nn.LayerNorm(self.hidden_dim),
+                nn.Linear(self.hidden_dim, 1),
+                nn.LeakyReLU(),
+            )
 
+        mid_features = self.hidden_dim if self.mid_dim is None else self.mid_dim
         self.input_mid =  nn.Sequential(
-            nn.LayerNorm(self.mid_dim),
-            nn.Linear(self.mid_dim, self.hidden_dim),
+            nn.LayerNorm(mid_features),
+            nn.Linear(mid_features, self.hidden_dim),
             nn.LeakyReLU(),
         )
         self.hidden_second = nn.ModuleList([nn.Sequential(
@@ -113,13 +187,27 @@ class SlurmNet(nn.Module):
             nn.ReLU(),
         )
 
-    def forward(self, X):
+    def forward(self, X, mask:torch.Tensor=None):
+        '''
+        @X (N, L, input_dim) workloads, @mask (N, L) True on the padded jobs (see train.data.pad_collate)
+        '''
         X = self.input_layer(X)
         for hidden in self.hidden_first:
             x_temp = hidden.forward(X)
             X = X + x_temp
-        X = self.mid_layer(X)
-        X = X.squeeze(-1)
+        if self.mid_layer is None:
+            if mask is None:
+                X = X.mean(dim=1)
+            else:
+                keep = (~mask).unsqueeze(-1).to(X.dtype)
+                X = (X * keep).sum(dim=1) / keep.sum(dim=1).clamp(min=1)
+        else:
+            X = self.mid_layer(X)
+            X = X.squeeze(-1)
+            if mask is not None:
+                X = X.masked_fill(mask, 0)
+            if X.size(1) < self.mid_dim:
+                X = nn.functional.pad(X, (0, self.mid_dim - X.size(1)))
         X = self.input_mid(X)
         for hidden in self.hidden_second:
             x_temp = hidden.forward(X)
@@ -0,0 +1,122 @@
+import json
+import queue
+import threading
+import zipfile
+
+from pathlib import Path
+
+# Per step artifacts of an env directory, everything else is rebuilt from the configuration
+ARTIFACTS = ['workload/first_job.events', 'results/slurm_acct.out']
+INDEX = 'index.jsonl'
+
+class Archiver:
+    '''
+    Class Archiver: append-only store of the simulation results.
+
+    submit reads the artifacts of every env right away (the next step overwrites them),
+    a background thread compresses them into @path/@name.zip as step_<i>/env_<j>/<artifact>
+    and appends one line for each env to @path/index.jsonl. Only the new data is written,
+    the simulations of the next step run while the previous one is stored.
+    '''
+
+    def __init__(self, path:str|Path, name:str='dataset', compression=zipfile.ZIP_DEFLATED):
+        self.path = path if isinstance(path, Path) else Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.archive = self.path / f'{name}.zip'
+        self.index = self.path / INDEX
+        self.compression = compression
+        self.queue = queue.Queue(maxsize=4)
+        self.error = None
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, step:int, envs:list[Path], info:list[dict]=None):
+        """
+        Queue the artifacts of a step.
+
+        Args:
+            step (int): step number
+            envs (list[Path]): env directories
+            info (list[dict], optional): extra fields for the index line of every env (e.g. status, reward). Defaults to None.
+        """
+        self.check()
+        entries = []
+        for j, env in enumerate(envs):
+            env = env if isinstance(env, Path) else Path(env)
+            files = {}
+            for artifact in ARTIFACTS:
+                if (env / artifact).exists():
+                    files[f'step_{step}/env_{j}/{artifact}'] = (env / artifact).read_bytes()
+            line = {'step': step, 'env': j, 'files': list(files.keys())}
+            if info is not None:
+                line.update(info[j])
+            entries.append((files, line))
+        self.queue.put(entries)
+
+    def run(self):
+        while True:
+            entries = self.queue.get()
+            try:
+                if entries is None:
+                    return
+                if self.error is None:
+                    self.store(entries)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def store(self, entries):
+        with zipfile.ZipFile(self.archive, mode='a', compression=self.compression) as archive:
+            for files, _ in entries:
+                for name, data in files.items():
+                    archive.writestr(name, data)
+        # The index is written after the data it points to
+        with open(self.index, mode='a') as f:
+            for _, line in entries:
+                f.write(json.dumps(line) + '\n')
+
+    def check(self):
+        if self.error is not None:
+            raise RuntimeError('archiver failed') from self.error
+
+    def flush(self):
+        self.queue.join()
+        self.check()
+
+    def close(self):
+        if self.worker.is_alive():
+            self.queue.put(None)
+            self.worker.join()
+        self.check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def read_index(path:str|Path) -> list[dict]:
+    path = path if isinstance(path, Path) else Path(path)
+    with open(path / INDEX, mode='r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def extract_archive(path:str|Path, target:str|Path, name:str='dataset'):
+    """
+    Unpack an archive as one env directory for each (step, env), env_<step>_<env>,
+    the layout read by train.data.SlurmDataset.
+
+    Args:
+        path (str | Path): archiver directory
+        target (str | Path): dataset directory
+        name (str, optional): archive name. Defaults to 'dataset'.
+    """
+    path = path if isinstance(path, Path) else Path(path)
+    target = target if isinstance(target, Path) else Path(target)
+    with zipfile.ZipFile(path / f'{name}.zip', mode='r') as archive:
+        for line in read_index(path):
+            sample = target / f"env_{line['step']}_{line['env']}"
+            for file in line['files']:
+                out = sample / file.split('/', 2)[2]
+                out.parent.mkdir(parents=True, exist_ok=True)
+                out.write_bytes(archive.read(file))
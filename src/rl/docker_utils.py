@@ -1,11 +1,46 @@
 import docker
-from time import sleep
+import os
+import threading
+from pathlib import Path
+from time import sleep, monotonic
+from typing import NamedTuple
+
+from slurm_sim.simulator import simulate_env
 
 PORTS  = {
     "8888/tcp":8888,
     '8787/tcp':8787,
 }
 
+IMAGE = "nsimakov/slurm_sim:v3.0"
+
+# Seconds between two readiness probes or two watchdog checks
+POLL = 0.1
+# Seconds given to a new container to accept exec
+READY_TIMEOUT = 60
+
+# Simulation outcomes
+OK = 'ok'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+STALLED = 'stalled'
+ABORTED = 'aborted'
+
+class SimResult(NamedTuple):
+    status: str
+    exit_code: int|None
+    output: bytes
+
+# One docker client for each process, shared by all the DockerSched
+_clients = {}
+
+def get_client() -> docker.DockerClient:
+    # Forked processes must not reuse the parent connection
+    pid = os.getpid()
+    if pid not in _clients:
+        _clients[pid] = docker.from_env()
+    return _clients[pid]
+
 def mount_stringify(local, virtual):
     return {
         local: {
@@ -15,16 +50,36 @@ def mount_stringify(local, virtual):
     }
 
 class DockerSched:
-    
-    def __init__(self, name:str, local_dir, virtual_path):
+    '''
+    Class DockerSched: runs the simulator of an env directory in a slurm_sim container.
+
+    While the simulation runs a watchdog looks at its outputs (results/ and the
+    scheduler logs): the run is killed when they stop growing for @stall seconds
+    or when it lasts more than @timeout seconds.
+
+    By default every execute starts a new container and removes it at the end.
+    In pool mode a single container is started on the first execute and kept running,
+    each execute is only an exec inside it: call close (or use the object as a
+    context manager) to stop and remove it.
+    '''
+
+    def __init__(self, name:str, local_dir, virtual_path, pool:bool=False):
         self.name = name
+        self.local_dir = local_dir if isinstance(local_dir, Path) else Path(local_dir)
         self.mount = mount_stringify(local_dir, virtual_path)
         self.wdr = virtual_path
-    
-    def execute(self, user='slurm', cmd='timeout 300s ./start.sh'):
-        client = docker.from_env()
+        self.pool = pool
+        self.container_id = None
+
+    def run_container(self):
+        client = get_client()
+        # A container left behind by a crashed run would hold the name
+        try:
+            client.containers.get(self.name).remove(force=True)
+        except docker.errors.NotFound:
+            pass
         container = client.containers.run(
-            image="nsimakov/slurm_sim:v3.0",
+            image=IMAGE,
             name=self.name,
             hostname="slurmsim",
             volumes=self.mount,
@@ -33,15 +88,172 @@ class DockerSched:
             #ports=PORTS
         )
 
-        sleep(5)
+        if not self.wait_ready(container):
+            container.remove(force=True)
+            raise TimeoutError(f'container {self.name} not ready after {READY_TIMEOUT}s')
+        return container
 
-        exit_code, output = container.exec_run(
-            cmd=cmd,
-            user=user,
-            workdir=self.wdr,
-        )
+    def wait_ready(self, container, timeout=READY_TIMEOUT, cmd='true') -> bool:
+        """
+        Probe the container until it accepts exec.
+
+        Args:
+            container: the started container
+            timeout (int, optional): seconds before giving up. Defaults to READY_TIMEOUT.
+            cmd (str, optional): probe command, ready when it exits with 0. Defaults to 'true'.
+
+        Returns:
+            bool: True when the container is ready
+        """
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            container.reload()
+            if container.status == 'running':
+                try:
+                    exit_code, _ = container.exec_run(cmd=cmd)
+                    if exit_code == 0:
+                        return True
+                except docker.errors.APIError:
+                    pass
+            elif container.status in ('exited', 'dead'):
+                return False
+            sleep(POLL)
+        return False
+
+    def progress(self) -> tuple:
+        '''
+        Sizes and modification times of the simulator outputs, changing as long as the simulated clock advances
+        '''
+        paths = [self.local_dir / 'log/sched.log', self.local_dir / 'log/jobcomp.log']
+        results = self.local_dir / 'results'
+        if results.is_dir():
+            paths.extend(sorted(path for path in results.rglob('*') if path.is_file()))
+        state = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                state.append((path.name, stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                pass
+        return tuple(state)
+
+    def exec_watched(self, container, cmd, user, timeout, stall, monitor=None) -> SimResult:
+        api = get_client().api
+        exec_id = api.exec_create(container.id, cmd, user=user, workdir=self.wdr)['Id']
+        output = []
+        runner = threading.Thread(target=lambda: output.append(api.exec_start(exec_id)), daemon=True)
+        runner.start()
+
+        status = OK
+        state = self.progress()
+        start = last = monotonic()
+        while runner.is_alive():
+            runner.join(POLL)
+            now = monotonic()
+            current = self.progress()
+            changed = current != state
+            if changed:
+                state, last = current, now
+            if now - start > timeout:
+                status = TIMEOUT
+            elif now - last > stall:
+                status = STALLED
+            elif changed and monitor is not None and monitor():
+                status = ABORTED
+            else:
+                continue
+            # Killing the container ends the exec, a pooled container is restarted at the next step
+            container.kill()
+            runner.join(READY_TIMEOUT)
+            break
+
+        exit_code = api.exec_inspect(exec_id)['ExitCode']
+        if status == OK and exit_code != 0:
+            status = FAILED
+        return SimResult(status, exit_code, output[0] if len(output) > 0 else b'')
+
+    def container(self):
+        '''
+        The pooled container, started (or restarted) when it is not running
+        '''
+        if self.container_id is not None:
+            try:
+                container = get_client().containers.get(self.container_id)
+                if container.status == 'running':
+                    return container
+                container.remove(force=True)
+            except docker.errors.NotFound:
+                pass
+        container = self.run_container()
+        self.container_id = container.id
+        return container
+
+    def execute(self, user='slurm', cmd='./start.sh', timeout=300, stall=120, monitor=None) -> SimResult:
+        """
+        Run the simulation.
+
+        Args:
+            user (str, optional): user running cmd. Defaults to 'slurm'.
+            cmd (str, optional): simulation command. Defaults to './start.sh'.
+            timeout (int, optional): maximum seconds of simulation. Defaults to 300.
+            stall (int, optional): maximum seconds without progress of the simulator outputs. Defaults to 120.
+            monitor (callable, optional): called by the watchdog when the outputs grow, the
+                simulation is aborted when it returns True (e.g. a WaitTail cutoff). Defaults to None.
+
+        Returns:
+            SimResult: status (ok, failed, timeout, stalled or aborted), exit code and output of cmd
+        """
+        try:
+            container = self.container() if self.pool else self.run_container()
+        except TimeoutError as e:
+            return SimResult(TIMEOUT, None, str(e).encode())
+
+        result = self.exec_watched(container, cmd, user, timeout, stall, monitor)
+
+        if not self.pool:
+            container.stop()
+            container.remove()
+
+        return result
+
+    def close(self):
+        if self.container_id is None:
+            return
+        try:
+            container = get_client().containers.get(self.container_id)
+            container.stop()
+            container.remove()
+        except docker.errors.NotFound:
+            pass
+        self.container_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class LocalSched:
+    '''
+    Class LocalSched: DockerSched replacement running slurm_sim.simulator in process,
+    it writes the same results/slurm_acct.out without slurmsim.
+    '''
+
+    def __init__(self, local_dir):
+        self.local_dir = local_dir if isinstance(local_dir, Path) else Path(local_dir)
+
+    def execute(self, *args, **kwargs) -> SimResult:
+        try:
+            simulator = simulate_env(self.local_dir)
+        except Exception as e:
+            return SimResult(FAILED, 1, repr(e).encode())
+        return SimResult(OK, 0, f'{len(simulator.rejected)} jobs rejected'.encode())
+
+    def close(self):
+        pass
 
-        container.stop()
-        container.remove()
+    def __enter__(self):
+        return self
 
-        return exit_code, output
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
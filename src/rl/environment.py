@@ -1,5 +1,4 @@
 import torch
-import pandas as pd
 import numpy as np
 import docker
 import os
@@ -7,8 +6,6 @@ import shutil
 
 from pathlib import Path
 
-from datetime import datetime, timedelta
-
 from slurm_load.workload import WorkLoad
 
 from app.utils import vectorize_job
@@ -19,24 +16,36 @@ from app.env_gen import SlurmEnvGen
 
 from slurm_topo.topology import TopologyPrinter
 
-from rl.docker_utils import DockerSched
+from rl.docker_utils import DockerSched, LocalSched, SimResult, OK, FAILED, ABORTED
+from rl.archive import Archiver
+from rl.sim_cache import SimCache
+
+from app.acct import mean_wait, WaitTail
 
 from app.utils import read_account, node_extract, topology_extract
-from slurm_load.utils import read_users_sim
-from slurm_load.job import JobGenerator
+from slurm_load.utils import read_users_sim, print_events
+from slurm_load.job import JobGenerator, JobTable
+from slurm_load.validate import validate_events, REPAIR
+from slurm_sim.simulator import read_setting, DEF_MEM_PER_CPU
 
 import subprocess
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import NamedTuple
+
 date_format = "%Y-%m-%dT%H:%M:%S"
 dir_name = "slurm_env_dir"
 
+class EnvStep(NamedTuple):
+    env: int
+    result: SimResult|None
+    reward: float|None
+    error: Exception|None
+    # Lower bound of the reward of a simulation aborted by the cutoff
+    bound: float|None = None
+
 def print_workload(path, jobs, zero):
-    with open(path / 'first_job.events', 'w') as f:
-        for td, job in jobs:
-            if zero:
-                f.write(f"-dt {0} -e submit_batch_job | {job}\n")
-            else:
-                f.write(f"-dt {td} -e submit_batch_job | {job}\n")
+    print_events(path / 'first_job.events', jobs, zero)
 
 '''class SlurmEnv(object):
     def __init__(self, save_path:str|Path, num_env=1):
@@ -105,15 +114,32 @@ def print_workload(path, jobs, zero):
 '''
 
 class SlurmSimpleEnv:
-    def __init__(self, save_path:str|Path, batch:int=10, sl_env=SlurmEnvGen()):
+    def __init__(self, save_path:str|Path, batch:int=10, sl_env=SlurmEnvGen(), pool:bool=False, backend:str='docker',
+                 rng:np.random.Generator=None, validate:str|None=REPAIR, cache:SimCache=None):
         self.save_path = save_path if isinstance(save_path, Path) else Path(save_path)
         self.sl_env = sl_env
         self.batch = batch
+        self.rng = rng
+        # Workload check before every simulation (see slurm_load.validate), None to skip it
+        self.validate = validate
+        # Results of the simulations already run, None to always simulate
+        self.cache = cache
+        self.backend = backend
+        self.topology = None
+        self.report = None
+        self.tail = None
+        self.metrics = None
         if not self.save_path.is_dir():
             raise ValueError("arg save_path is not an existing directory")
         self.dir_setup()
         docker_name = f"slurm_{self.save_path.name}"
-        self.docker_sched = DockerSched(docker_name, self.save_path, "/home/slurm/mount")
+        if backend == 'docker':
+            self.docker_sched = DockerSched(docker_name, self.save_path, "/home/slurm/mount", pool=pool)
+        elif backend == 'local':
+            # In-process simulator, see slurm_sim.simulator
+            self.docker_sched = LocalSched(self.save_path)
+        else:
+            raise ValueError(f"unknown backend {backend}")
     
     def slurm_setup(self):
         topology_app = TopologyApp(self.save_path, Path("/home/slurm/mount"))
@@ -125,11 +151,16 @@ class SlurmSimpleEnv:
         topology_app.print_users_sim(self.sl_env.users)
         topology_app.print_sim_conf()
         topology_app.copy_cert()
-        topology_app.print_start()
         #topology_app.print_workload(self.sl_env.generate_workload(self.batch))
         self.workload_gen = self.sl_env.workload
+        if self.rng is not None:
+            # Own stream: sl_env is shared by the envs of a SlurmMultiEnv
+            self.workload_gen = self.workload_gen.spawn(self.rng)
 
     def dir_setup(self, force=False):
+        if force and (self.save_path / 'etc').exists():
+            # etc/ files can be hardlinks shared with other envs (see clone_env): never rewrite them in place
+            shutil.rmtree(self.save_path / 'etc')
         if (not (self.save_path / 'etc/slurm.conf').exists()) or force:
             self.slurm_setup()
         else:
@@ -138,45 +169,150 @@ class SlurmSimpleEnv:
             accounts = read_account(p / 'etc/sacctmgr.script')
             nodes = node_extract(p / 'etc/slurm.conf')
             topo = topology_extract(p / 'etc/topology.conf', nodes)
-            job_gen = JobGenerator(topology=topo)
+            job_gen = JobGenerator(topology=topo, rng=self.rng)
             self.workload_gen = WorkLoad(users[1:], accounts, job_gen)
-            self.obs = self.workload_gen.generate_workload(self.batch)
-
-    def step(self, action:torch.Tensor=None, zero=False, reset=False):
+        # Same draws for a new and an existing directory: a rerun replays the same workloads
+        self.obs = self.workload_gen.generate_workload_batch(self.batch)
+        TopologyApp(self.save_path, Path("/home/slurm/mount")).print_start(rng=self.workload_gen.rng)
+
+    def step(self, action:torch.Tensor=None, zero=False, reset=False, cutoff:float=None):
+        """
+        Simulate the workload of the env.
+
+        Args:
+            action (torch.Tensor, optional): unused. Defaults to None.
+            zero (bool, optional): submit every job at time 0, with reset. Defaults to False.
+            reset (bool, optional): draw a new workload first. Defaults to False.
+            cutoff (float, optional): abort the simulation as soon as the mean wait (seconds)
+                is sure to exceed it, see WaitTail. Defaults to None (run to completion).
+
+        Returns:
+            SimResult: outcome of the simulation
+        """
         if reset:
             self.reset(zero)
-        exit_code, log = self.docker_sched.execute()
+        self.metrics = None
+        if self.validate is not None:
+            self.obs, self.report = self.validate_workload()
+            if self.report['rejected'] == self.report['jobs']:
+                # Nothing could ever run: no simulation at all
+                self.result = SimResult(FAILED, None, b'no valid job in the workload')
+                return self.result
+        key = None
+        if self.cache is not None:
+            # After the validation: the key covers the workload actually simulated
+            key = self.cache.key(self.save_path, self.backend)
+            self.metrics = self.cache.restore(key, self.save_path)
+            if self.metrics is not None:
+                self.result = SimResult(OK, 0, b'cached')
+                return self.result
+        monitor = None
+        if cutoff is not None:
+            log = self.save_path / 'log/jobcomp.log'
+            log.unlink(missing_ok=True)
+            self.tail = WaitTail(log, self.workload_size())
+            monitor = lambda: self.tail.poll() > 0 and self.tail.lower_bound() > cutoff
+        self.result = self.docker_sched.execute(monitor=monitor)
+        if key is not None and self.result.status == OK:
+            self.metrics = self.cache.put(key, self.save_path)
+        return self.result
+
+    def workload_size(self) -> int:
+        with open(self.save_path / 'workload/first_job.events', mode='rb') as f:
+            return sum(1 for line in f if line.strip())
+
+    def validate_workload(self) -> tuple[JobTable, dict]:
+        '''
+        Reject or repair the jobs of workload/first_job.events that the cluster can never run,
+        the validated workload becomes the observation
+        '''
+        if self.topology is None:
+            nodes = node_extract(self.save_path / 'etc/slurm.conf')
+            self.topology = topology_extract(self.save_path / 'etc/topology.conf', nodes)
+            self.def_mem_per_cpu = read_setting(self.save_path / 'etc/slurm.conf', 'DefMemPerCPU', DEF_MEM_PER_CPU)
+        return validate_events(self.save_path / 'workload/first_job.events', self.topology, self.validate, self.def_mem_per_cpu)
 
     def reset(self, zero):
         self.observe()
         topology_app = TopologyApp(self.save_path, Path("/home/slurm/mount"))
-        topology_app.print_start()
+        topology_app.print_start(rng=self.workload_gen.rng)
         print_workload(self.save_path / "workload", self.obs, zero)
         #print(log)
 
     def observe(self):
-        self.obs = self.workload_gen.generate_workload(self.batch)
+        self.obs = self.workload_gen.generate_workload_batch(self.batch)
+
+    def close(self):
+        self.docker_sched.close()
 
     def reward_calculation(self) -> float:
-        executed_time = 0
-        wait_time = 0
+        if self.metrics is not None:
+            return self.metrics['mean_wait']
         loc = self.save_path / "results/slurm_acct.out"
-
-        data = pd.read_csv(loc, sep='|', header=0)
-        eligible = data['Eligible'].apply(lambda x : datetime.strptime(x, date_format))
-        start = data['Start'].apply(lambda x : datetime.strptime(x, date_format))
-        wait_time = start - eligible
-        wait_time = wait_time.apply(lambda x : x.total_seconds()).mean()
-
-        return wait_time
+        return mean_wait(loc)
+
+# Env layout: read-only directories shared by hardlinks, per env files and directories
+SHARED_DIRS = ['etc']
+ENV_FILES = ['start.sh']
+ENV_DIRS = ['workload', 'results', 'log']
+
+def link_tree(src:Path, dst:Path):
+    '''
+    Recreate the @src tree in @dst with hardlinks to its files, copies where links are not possible
+    '''
+    dst.mkdir(parents=True, exist_ok=True)
+    for entry in os.scandir(src):
+        target = dst / entry.name
+        if entry.is_dir(follow_symlinks=False):
+            link_tree(Path(entry.path), target)
+            continue
+        try:
+            os.link(entry.path, target)
+        except OSError:
+            shutil.copy2(entry.path, target)
+
+def clone_env(base:Path, path:Path):
+    """
+    Create the env directory @path from @base: the configuration (etc/) is hardlinked,
+    start.sh is copied and workload/, results/ and log/ start empty.
+    Hardlinks, unlike symlinks, still resolve inside the simulator container.
+
+    Args:
+        base (Path): env directory to clone
+        path (Path): new env directory, replaced if it exists
+    """
+    if path.exists():
+        shutil.rmtree(path)
+    path.mkdir(parents=True)
+    for name in SHARED_DIRS:
+        if (base / name).is_dir():
+            link_tree(base / name, path / name)
+    for name in ENV_FILES:
+        if (base / name).exists():
+            shutil.copy2(base / name, path / name)
+    for name in ENV_DIRS:
+        (path / name).mkdir()
 
 class SlurmMultiEnv:
-    def __init__(self, save_path:str|Path, env_number:int=1, batch:int=10, sl_env=SlurmEnvGen()):
+    def __init__(self, save_path:str|Path, env_number:int=1, batch:int=10, sl_env=SlurmEnvGen(), pool:bool=False, workers:int=None, backend:str='docker',
+                 seed:int|np.random.SeedSequence=None, validate:str|None=REPAIR, cache:SimCache=None):
         self.save_path = save_path if isinstance(save_path, Path) else Path(save_path)
         self.sl_env = sl_env
         self.batch = batch
         self.env_number = env_number
         self.zero = False
+        self.pool = pool
+        self.backend = backend
+        self.validate = validate
+        # Shared by all the envs
+        self.cache = cache
+        # One independent random stream for the workloads of each env
+        seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self.rngs = [np.random.default_rng(child) for child in seed.spawn(env_number)]
+        # Maximum number of simulations running together
+        self.workers = min(env_number, os.cpu_count()) if workers is None else workers
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.pending = []
         if not self.save_path.is_dir():
             raise ValueError("arg save_path is not an existing directory")
         
@@ -187,29 +323,70 @@ class SlurmMultiEnv:
     def env_setup(self):
         if not self.envs_path[0].exists():
             os.mkdir(self.envs_path[0])
-        self.envs.append(SlurmSimpleEnv(self.envs_path[0], self.batch, self.sl_env))
+        self.envs.append(SlurmSimpleEnv(self.envs_path[0], self.batch, self.sl_env, self.pool, self.backend, self.rngs[0], self.validate, self.cache))
         for i in range(1, self.env_number):
-            if self.envs_path[i].exists(): shutil.rmtree(self.envs_path[i])
-            shutil.copytree(self.envs_path[0], self.envs_path[i], dirs_exist_ok=True)
-            self.envs.append(SlurmSimpleEnv(self.envs_path[i], self.batch,self.sl_env))
+            clone_env(self.envs_path[0], self.envs_path[i])
+            self.envs.append(SlurmSimpleEnv(self.envs_path[i], self.batch,self.sl_env, self.pool, self.backend, self.rngs[i], self.validate, self.cache))
     
-    def step(self, reward=False) -> None|list[float]:
-        pids = []
-        for i in range(self.env_number):
-            self.envs[i].reset(self.zero)
-            pid = os.fork()
-            if pid == 0:
-                self.envs[i].step()
-                os._exit(1)
-            pids.append(pid)
-        for pid in pids:
-            os.waitpid(pid, 0)
+    def run_env(self, i:int, reward:bool, cutoff:float=None) -> EnvStep:
+        try:
+            result = self.envs[i].step(cutoff=cutoff)
+            value = self.envs[i].reward_calculation() if reward and result.status == OK else None
+            bound = self.envs[i].tail.lower_bound() if result.status == ABORTED else None
+            return EnvStep(i, result, value, None, bound)
+        except Exception as e:
+            return EnvStep(i, None, None, e)
+
+    def step_async(self, reward=False, cutoff:float=None):
+        """
+        Reset every env with a new workload and start its simulation in the worker pool.
+
+        Args:
+            reward (bool, optional): compute the reward of every successful simulation. Defaults to False.
+            cutoff (float, optional): abort the simulations whose mean wait (seconds) is sure
+                to exceed it, their EnvStep holds the lower bound reached. Defaults to None.
+        """
+        if len(self.pending) > 0:
+            raise RuntimeError("step_async called while a step is still running")
+        for env in self.envs:
+            env.reset(self.zero)
+        self.pending = [self.executor.submit(self.run_env, i, reward, cutoff) for i in range(self.env_number)]
+
+    def step_iter(self):
+        '''
+        Yield the EnvStep of the running step as each env finishes
+        '''
+        pending, self.pending = self.pending, []
+        for future in as_completed(pending):
+            yield future.result()
+
+    def step_wait(self) -> list[EnvStep]:
+        """
+        Wait for the running step.
+
+        Returns:
+            list[EnvStep]: outcome of every env, in env order. A failed env holds its
+                exception in error, a simulation that did not complete has no reward.
+        """
+        return sorted(self.step_iter(), key=lambda step: step.env)
+
+    def step(self, reward=False, cutoff:float=None) -> None|list[float|None]:
+        self.step_async(reward, cutoff)
+        steps = self.step_wait()
         if not reward:
             return None
-        rewards = []
+        return [step.reward for step in steps]
+
+    def close(self):
+        self.executor.shutdown(wait=True)
         for env in self.envs:
-            rewards.append(env.reward_calculation())
-        return rewards
+            env.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 class DummyEnv(object):
     def __init__(self, workload:WorkLoad, job_num:int = 25):
@@ -229,7 +406,7 @@ class DummyEnv(object):
         return self.obs
     
     def reset(self):
-        self.jobs = self.workload.generate_workload(self.job_num)
+        self.jobs = self.workload.generate_workload_batch(self.job_num)
         self.obs = vectorize_job(self.jobs).float()
 
 if __name__ == '__main__':
@@ -246,16 +423,20 @@ if __name__ == '__main__':
 
     path = Path("/home/ago/tesi/slurm_ai_sched/src/tests/env")
     save = Path("/home/ago/tesi/slurm_ai_sched/src/tests/saved")
-    env = SlurmMultiEnv(path, 16, batch=16)
+    env = SlurmMultiEnv(path, 16, batch=16, pool=True)
     env.zero=True
+    # Only the new events and results are stored, while the next step runs
+    archiver = Archiver(save)
     for i in range(90, 200):
         start = time.time()
-        env.step()
+        env.step_async()
+        steps = env.step_wait()
         end = time.time()
         print(end - start)
-        shutil.make_archive(f'{save.as_posix()}/env_{i}', 'zip', path)
+        archiver.submit(i, env.envs_path, [{'status': step.result.status if step.result is not None else 'error'} for step in steps])
         subprocess.run([
             "date",
             ],
         )
-        
\ No newline at end of file
+    archiver.close()
+    env.close()
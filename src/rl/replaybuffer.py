@@ -1,35 +1,189 @@
+import json
+import os
 from dataclasses import dataclass
-from typing import Any, Dict, Generator, Iterable, Union
+from pathlib import Path
+from typing import Any, Dict, Generator, Iterable, Optional, Tuple, Union
 
 import numpy as np
 
 import torch
 
+# Pointer state and buffer schemas of a disk-backed buffer
+HEADER = "header.json"
+
 
 @dataclass
 class ReplayBuffer:
+    """
+    Ring buffer of transitions, one array for each named buffer.
+
+    With a path every numeric buffer is a .npy file memory-mapped from the
+    path directory, so the buffer can be larger than memory and outlives the
+    process. The pointer state lives in path/header.json, written by checkpoint:
+    data is flushed first and the header replaced atomically, a crash leaves the
+    last checkpoint readable. Once the ring is full a store overwrites items the
+    header counts, so it first checkpoints a size that leaves the target slots out,
+    then writes them and checkpoints again: a crash mid-store only loses those items.
+    The items are the size slots before ptr. Creating a buffer on an existing path
+    reopens it.
+
+    Example:
+        .. code-block:: python
+
+            buffer = ReplayBuffer(max_size=10_000_000, path="replay")
+            buffer.initialize_buffer("obs", shape=(16, 5), dtype=np.float32)
+            buffer.store_batch(obs=np.zeros((8, 16, 5)))
+            buffer.checkpoint()
+
+            # Another process
+            reader = ReplayBuffer.open("replay", readonly=True)
+    """
     max_size: int = 100
+    path: Optional[Union[str, Path]] = None
+    readonly: bool = False
 
     def __post_init__(self) -> None:
         self.buffers = set()
+        self.schemas = {}
         self.ptr = 0
         self.size = 0
+        if self.path is not None:
+            self.path = Path(self.path)
+            if (self.path / HEADER).exists():
+                self.refresh()
+            elif self.readonly:
+                raise FileNotFoundError(self.path / HEADER)
+            else:
+                self.path.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def open(cls, path: Union[str, Path], readonly: bool = False, **kwargs: Any) -> "ReplayBuffer":
+        """
+        Open an existing disk-backed buffer with its stored size.
+
+        Args:
+            path (Union[str, Path]): The buffer directory.
+            readonly (bool): Map the buffers read-only, e.g. for a training process
+                reading the buffer of a running collector. Defaults to False.
+
+        Returns:
+            ReplayBuffer: The reopened buffer.
+        """
+        with open(Path(path) / HEADER, mode="r") as f:
+            max_size = json.load(f)["max_size"]
+        return cls(max_size=max_size, path=path, readonly=readonly, **kwargs)
+
+    def state(self) -> dict:
+        """
+        The header content of a disk-backed buffer.
+        """
+        return {
+            "max_size": self.max_size,
+            "ptr": self.ptr,
+            "size": self.size,
+            "schemas": {k: [list(shape), dtype.str] for k, (shape, dtype) in self.schemas.items()},
+        }
+
+    def load_state(self, state: dict) -> None:
+        if state["max_size"] != self.max_size:
+            raise ValueError(f"buffer at {self.path} has max_size {state['max_size']}, not {self.max_size}")
+        self.ptr = state["ptr"]
+        self.size = state["size"]
+        for k, (shape, dtype) in state["schemas"].items():
+            if k not in self.buffers:
+                self.initialize_buffer(k, tuple(shape), np.dtype(dtype))
+
+    def refresh(self) -> None:
+        """
+        Reload the last checkpoint of a disk-backed buffer (new pointer state and buffers).
+        """
+        with open(self.path / HEADER, mode="r") as f:
+            self.load_state(json.load(f))
+
+    def checkpoint(self, size: Optional[int] = None) -> None:
+        """
+        Persist a disk-backed buffer: flush the mapped buffers, then atomically
+        replace the header, so it never points to unwritten data.
+
+        Args:
+            size (Optional[int]): Item count written in the header, smaller than the
+                current one to leave out slots about to be overwritten. Defaults to None
+                (the current size).
+        """
+        for k in self.buffers:
+            getattr(self, k).flush()
+        state = self.state()
+        if size is not None:
+            state["size"] = size
+        tmp = self.path / (HEADER + ".tmp")
+        with open(tmp, mode="w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path / HEADER)
+
+    def open_array(self, name: str, shape: Tuple[int, ...], dtype: np.dtype) -> np.ndarray:
+        """
+        Memory-map path/name.npy, created with zeros when missing.
+
+        Args:
+            name (str): The file name, without extension.
+            shape (Tuple[int, ...]): Array shape.
+            dtype (np.dtype): Array type.
+
+        Returns:
+            np.ndarray: The mapped array.
+        """
+        file = self.path / f"{name}.npy"
+        if file.exists() or self.readonly:
+            array = np.load(file, mmap_mode="r" if self.readonly else "r+")
+            if array.shape != shape or array.dtype != dtype:
+                raise ValueError(f"{file} holds {array.dtype}{array.shape}, not {dtype}{shape}")
+            return array
+        return np.lib.format.open_memmap(file, mode="w+", shape=shape, dtype=dtype)
 
     def reset(self) -> None:
         """
         Clears all buffer values.
+        A disk-backed buffer only resets its pointer state, stale items are overwritten by the next ones.
         """
-        for buffer in self.buffers:
-            self.initialize_buffer(buffer)
+        if self.path is None:
+            for buffer in self.buffers:
+                self.initialize_buffer(buffer, *self.schemas[buffer])
+        self.ptr = 0
+        self.size = 0
     
-    def initialize_buffer(self, buffer_name: str) -> None:
+    def initialize_buffer(self, buffer_name: str, shape: Optional[Tuple[int, ...]] = None, dtype: Any = object) -> None:
         """
         Initialize a new buffer in memory.
+        Buffers with a numeric dtype are a single contiguous (max_size, *shape) array,
+        object buffers (the default) hold any value. A disk-backed buffer maps
+        path/buffer_name.npy, reusing its content when it already exists, and only
+        supports numeric buffers.
 
         Args:
             buffer_name (str): The name of the buffer.
+            shape (Optional[Tuple[int, ...]]): Shape of a single entry. Defaults to None (scalar).
+            dtype (Any): Entry type. Defaults to object.
+
+        Example:
+            .. code-block:: python
+
+                buffer = ReplayBuffer(max_size=1_000_000)
+                buffer.initialize_buffer("obs", shape=(16, 5), dtype=np.float32)
+                buffer.initialize_buffer("reward", dtype=np.float32)
         """
-        setattr(self, buffer_name, np.empty(self.max_size, dtype=object))
+        shape = () if shape is None else tuple(shape)
+        dtype = np.dtype(dtype)
+        if self.path is not None:
+            if dtype == object:
+                raise ValueError(f"disk-backed buffer {buffer_name} needs a numeric dtype")
+            setattr(self, buffer_name, self.open_array(buffer_name, (self.max_size,) + shape, dtype))
+        elif dtype == object:
+            setattr(self, buffer_name, np.empty((self.max_size,) + shape, dtype=object))
+        else:
+            setattr(self, buffer_name, np.zeros((self.max_size,) + shape, dtype=dtype))
+        self.schemas[buffer_name] = (shape, dtype)
         self.buffers.add(buffer_name)
 
     def store(self, **kwargs: object) -> None:
@@ -49,11 +203,89 @@ class ReplayBuffer:
                         chain2 = 2*i
                     )
         """
+        idx = np.array([self.ptr])
+        overwrite = self.begin_store(idx)
         for k, v in kwargs.items():
             getattr(self, k)[self.ptr] = v
 
         self.ptr = (self.ptr + 1) % self.max_size
         self.size = min(self.size + 1, self.max_size)
+        self.end_store(idx, overwrite)
+
+    def store_batch(self, **kwargs: np.ndarray) -> None:
+        """
+        Store a batch of items in each buffer, e.g. one for every env of a step.
+        Every value has the batch as its first dimension.
+
+        Example:
+            .. code-block:: python
+
+                buffer = ReplayBuffer()
+                buffer.initialize_buffer("obs", shape=(16, 5), dtype=np.float32)
+                buffer.initialize_buffer("reward", dtype=np.float32)
+
+                buffer.store_batch(
+                    obs = np.zeros((8, 16, 5)),
+                    reward = np.ones(8),
+                )
+        """
+        n = len(next(iter(kwargs.values())))
+        # Only the last max_size items of a larger batch survive
+        skip = max(0, n - self.max_size)
+        idx = (self.ptr + skip + np.arange(n - skip)) % self.max_size
+        overwrite = self.begin_store(idx)
+        for k, v in kwargs.items():
+            getattr(self, k)[idx] = v[skip:]
+
+        self.ptr = (self.ptr + n) % self.max_size
+        self.size = min(self.size + n, self.max_size)
+        self.end_store(idx, overwrite)
+
+    def overwrites(self, idx: np.ndarray) -> bool:
+        """
+        Whether a store to the idx slots of a disk-backed buffer overwrites stored items.
+        """
+        return self.path is not None and self.size + len(idx) > self.max_size
+
+    def begin_store(self, idx: np.ndarray) -> bool:
+        """
+        Before a store to the idx slots: if it overwrites stored items, checkpoint
+        a size that leaves the slots out, so a crash while they are written (some
+        buffers new, some old) never exposes them.
+
+        Args:
+            idx (np.ndarray): Slots about to be written, starting at ptr.
+
+        Returns:
+            bool: Whether the slots were left out, end_store then checkpoints them.
+        """
+        overwrite = self.overwrites(idx)
+        if overwrite:
+            self.checkpoint(size=self.max_size - len(idx))
+        return overwrite
+
+    def end_store(self, idx: np.ndarray, overwrite: bool) -> None:
+        """
+        After a store to the idx slots, checkpoint them back if begin_store left them out.
+
+        Args:
+            idx (np.ndarray): Slots just written.
+            overwrite (bool): What begin_store returned.
+        """
+        if overwrite:
+            self.checkpoint()
+
+    def to_torch(self, values: dict) -> dict:
+        """
+        Wrap numeric buffer values as tensors, sharing their memory.
+
+        Args:
+            values (dict): Buffer name to values, as returned by __getitem__.
+
+        Returns:
+            dict: The same dictionary with torch tensors for the numeric buffers.
+        """
+        return {k: torch.from_numpy(v) if self.schemas[k][1] != object else v for k, v in values.items()}
 
     def sample(self, n: int) -> dict:
         """
@@ -64,10 +296,11 @@ class ReplayBuffer:
 
         Returns:
             dict: Buffer name to iterable of sample values key, value pairs
-                for each buffer.
+                for each buffer, torch tensors for the numeric buffers.
         """
-        idx = np.random.randint(low=0, high=self.size, size=n)
-        return self[idx]
+        # The items are the size slots before ptr
+        idx = (self.ptr - self.size + np.random.randint(low=0, high=self.size, size=n)) % self.max_size
+        return self.to_torch(self[idx])
     
     def previous(self, n: int) -> dict:
         """
@@ -163,4 +396,160 @@ class ReplayBuffer:
         Returns:
             int: Maximum buffer size.
         """
-        return self.size
\ No newline at end of file
+        return self.size
+
+@dataclass
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+    ReplayBuffer sampling each item with probability priority^alpha / sum(priority^alpha).
+
+    Priorities live in an array sum-tree: leaves at [capacity, 2 * capacity), every
+    inner node i holds tree[2i] + tree[2i + 1] and tree[1] is the total. New items get
+    the highest priority seen so far, update_priorities sets them from the TD errors.
+    """
+    alpha: float = 0.6
+    beta: float = 0.4
+    eps: float = 1e-6
+
+    def __post_init__(self) -> None:
+        self.capacity = 1
+        while self.capacity < self.max_size:
+            self.capacity *= 2
+        self.depth = self.capacity.bit_length() - 1
+        self.max_priority = 1.0
+        # A disk-backed buffer keeps the tree next to the data, the header is read by super
+        if self.path is not None:
+            self.path = Path(self.path)
+            if not self.readonly:
+                self.path.mkdir(parents=True, exist_ok=True)
+            self.tree = self.open_array("priorities", (2 * self.capacity,), np.dtype(np.float64))
+        else:
+            self.tree = np.zeros(2 * self.capacity, dtype=np.float64)
+        super().__post_init__()
+
+    def state(self) -> dict:
+        return {**super().state(), "max_priority": self.max_priority}
+
+    def load_state(self, state: dict) -> None:
+        super().load_state(state)
+        self.max_priority = state["max_priority"]
+
+    def checkpoint(self, size: Optional[int] = None) -> None:
+        self.tree.flush()
+        super().checkpoint(size)
+
+    def reset(self) -> None:
+        super().reset()
+        self.tree[:] = 0
+        self.max_priority = 1.0
+
+    def set_priorities(self, idx: np.ndarray, priorities: np.ndarray) -> None:
+        """
+        Set the (already exponentiated) priorities of some items, O(log n) for each one.
+
+        Args:
+            idx (np.ndarray): Item indices.
+            priorities (np.ndarray): New priorities.
+        """
+        node = np.asarray(idx, dtype=np.int64) + self.capacity
+        self.tree[node] = priorities
+        for _ in range(self.depth):
+            node = np.unique(node // 2)
+            self.tree[node] = self.tree[2 * node] + self.tree[2 * node + 1]
+
+    def begin_store(self, idx: np.ndarray) -> bool:
+        # Slots left out of the header must not be sampled either
+        if self.overwrites(idx):
+            self.set_priorities(idx, np.zeros(len(idx)))
+        return super().begin_store(idx)
+
+    def end_store(self, idx: np.ndarray, overwrite: bool) -> None:
+        self.set_priorities(idx, np.full(len(idx), self.max_priority ** self.alpha))
+        super().end_store(idx, overwrite)
+
+    def sample_indices(self, n: int) -> np.ndarray:
+        """
+        Draw n indices, one in each of n equal slices of the total priority.
+
+        Args:
+            n (int): The size of the sample.
+
+        Returns:
+            np.ndarray: Item indices.
+        """
+        total = self.tree[1]
+        target = (np.arange(n) + np.random.random(n)) * (total / n)
+        node = np.ones(n, dtype=np.int64)
+        for _ in range(self.depth):
+            left = self.tree[2 * node]
+            right = target >= left
+            target -= left * right
+            node = 2 * node + right
+        # Rounding can land on an empty leaf, past the stored items or left out by a crashed store
+        return np.where(self.tree[node] > 0, node - self.capacity, (self.ptr - 1) % self.max_size)
+
+    def sample(self, n: int) -> dict:
+        """
+        Prioritized sample over all buffers.
+
+        Args:
+            n (int): The size of the sample.
+
+        Returns:
+            dict: Buffer name to sample values, as ReplayBuffer.sample, plus "indices"
+                (for update_priorities) and the importance sampling "weights"
+                (size * P(i))^-beta, normalized by their maximum.
+        """
+        idx = self.sample_indices(n)
+        probs = self.tree[idx + self.capacity] / self.tree[1]
+        weights = (self.size * probs) ** -self.beta
+        weights /= weights.max()
+        values = self.to_torch(self[idx])
+        values["indices"] = torch.from_numpy(idx)
+        values["weights"] = torch.from_numpy(weights.astype(np.float32))
+        return values
+
+    def update_priorities(self, idx: Union[np.ndarray, torch.Tensor], td_errors: Union[np.ndarray, torch.Tensor]) -> None:
+        """
+        Set the priorities of sampled items from their TD errors.
+
+        Args:
+            idx (Union[np.ndarray, torch.Tensor]): The "indices" returned by sample.
+            td_errors (Union[np.ndarray, torch.Tensor]): TD errors of the items.
+        """
+        if isinstance(idx, torch.Tensor):
+            idx = idx.cpu().numpy()
+        if isinstance(td_errors, torch.Tensor):
+            td_errors = td_errors.detach().cpu().numpy()
+        priorities = np.abs(np.asarray(td_errors, dtype=np.float64)) + self.eps
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        # A repeated index keeps its last priority
+        idx, last = np.unique(np.asarray(idx)[::-1], return_index=True)
+        self.set_priorities(idx, priorities[::-1][last] ** self.alpha)
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    # A store interrupted after writing only some of the buffers of a full ring
+    for cls in [ReplayBuffer, PrioritizedReplayBuffer]:
+        path = Path(tempfile.mkdtemp()) / "replay"
+        buffer = cls(max_size=8, path=path)
+        buffer.initialize_buffer("obs", shape=(2,), dtype=np.float32)
+        buffer.initialize_buffer("reward", dtype=np.float32)
+        for i in range(3):
+            values = np.arange(4 * i, 4 * i + 4, dtype=np.float32)
+            buffer.store_batch(obs=np.stack([values, values], axis=1), reward=values)
+        buffer.checkpoint()
+        idx = (buffer.ptr + np.arange(3)) % buffer.max_size
+        buffer.begin_store(idx)
+        buffer.obs[idx] = -1
+        buffer.obs.flush()
+        del buffer
+
+        reader = cls.open(path, readonly=True)
+        sample = reader.sample(1000)
+        assert len(reader) == 5
+        assert torch.equal(sample["obs"][:, 0], sample["reward"]), "torn transition sampled"
+        assert (sample["reward"] >= 7).all(), "stale transition sampled"
+        print(cls.__name__, "ok")
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import threading
+
+from pathlib import Path
+
+from app.acct import mean_wait
+
+# Inputs of a simulation, relative to the env directory: every file under etc/ plus these
+KEY_FILES = ['start.sh', 'workload/first_job.events']
+RESULT = 'results/slurm_acct.out'
+
+class SimCache:
+    '''
+    Class SimCache: simulation results addressed by the content of their inputs.
+
+    The key of an env directory is the sha256 of its configuration (etc/), start.sh,
+    workload/first_job.events and of the simulator backend: two envs with the same key
+    simulate the same thing, and LocalSched results never stand in for slurmsim ones.
+    Every entry is @path/<key[:2]>/<key>.out (the slurm_acct.out) and <key>.json (its
+    metrics). Entries are written atomically, a hit refreshes their modification time
+    and the least recently used ones are evicted when the cache grows past @max_bytes.
+    The cache can be shared by the threads of a SlurmMultiEnv and by other processes.
+    '''
+
+    def __init__(self, path:str|Path, max_bytes:int=1 << 30):
+        self.path = path if isinstance(path, Path) else Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.size = sum(entry.stat().st_size for entry in self.entries())
+        self.hits = 0
+        self.misses = 0
+
+    def entries(self) -> list[Path]:
+        return [entry for entry in self.path.glob('*/*') if entry.suffix in ('.out', '.json')]
+
+    def key(self, env:str|Path, backend:str='docker') -> str:
+        """
+        Content hash of the simulation inputs of an env directory.
+
+        Args:
+            env (str | Path): env directory
+            backend (str, optional): simulator running the env (see SlurmSimpleEnv). Defaults to 'docker'.
+
+        Returns:
+            str: hex sha256
+        """
+        env = env if isinstance(env, Path) else Path(env)
+        files = sorted(path.relative_to(env).as_posix() for path in (env / 'etc').rglob('*') if path.is_file())
+        files += [name for name in KEY_FILES if (env / name).is_file()]
+        digest = hashlib.sha256(f'{backend}\0'.encode())
+        for name in files:
+            data = (env / name).read_bytes()
+            # Names and lengths delimit the contents
+            digest.update(f'{name}\0{len(data)}\0'.encode())
+            digest.update(data)
+        return digest.hexdigest()
+
+    def entry(self, key:str, suffix:str) -> Path:
+        return self.path / key[:2] / f'{key}{suffix}'
+
+    def restore(self, key:str, env:str|Path) -> dict|None:
+        """
+        Copy a cached result into an env directory.
+
+        Args:
+            key (str): key of the env inputs
+            env (str | Path): env directory
+
+        Returns:
+            dict|None: the metrics of the result, None on a miss
+        """
+        env = env if isinstance(env, Path) else Path(env)
+        try:
+            data = self.entry(key, '.out').read_bytes()
+            metrics = json.loads(self.entry(key, '.json').read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            with self.lock:
+                self.misses += 1
+            return None
+        (env / RESULT).parent.mkdir(parents=True, exist_ok=True)
+        (env / RESULT).write_bytes(data)
+        for suffix in ('.out', '.json'):
+            try:
+                os.utime(self.entry(key, suffix))
+            except FileNotFoundError:
+                pass
+        with self.lock:
+            self.hits += 1
+        return metrics
+
+    def put(self, key:str, env:str|Path) -> dict:
+        """
+        Store the result of an env directory.
+
+        Args:
+            key (str): key of the env inputs, computed before the simulation
+            env (str | Path): env directory, with its results/slurm_acct.out
+
+        Returns:
+            dict: the metrics stored with the result
+        """
+        env = env if isinstance(env, Path) else Path(env)
+        metrics = {'mean_wait': mean_wait(env / RESULT)}
+        files = {'.out': (env / RESULT).read_bytes(), '.json': json.dumps(metrics).encode()}
+        self.entry(key, '').parent.mkdir(exist_ok=True)
+        added = 0
+        # The metrics are written last: an entry is only visible once complete
+        for suffix in ('.out', '.json'):
+            target = self.entry(key, suffix)
+            tmp = target.with_name(f'{target.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+            tmp.write_bytes(files[suffix])
+            old = target.stat().st_size if target.exists() else 0
+            os.replace(tmp, target)
+            added += len(files[suffix]) - old
+        with self.lock:
+            self.size += added
+            if self.size > self.max_bytes:
+                self.evict()
+        return metrics
+
+    def evict(self):
+        '''
+        Remove the least recently used entries until the cache is below 3/4 of max_bytes
+        '''
+        entries = {}
+        for path in self.entries():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            # An entry is as recent as its last touched file, the result and its metrics go together
+            used, size, paths = entries.get(path.stem, (0, 0, []))
+            entries[path.stem] = (max(used, stat.st_mtime_ns), size + stat.st_size, paths + [path])
+        # Other processes may have filled the cache too
+        self.size = sum(size for _, size, _ in entries.values())
+        for _, size, paths in sorted(entries.values(), key=lambda entry: entry[0]):
+            if self.size <= self.max_bytes * 3 // 4:
+                break
+            for path in paths:
+                path.unlink(missing_ok=True)
+            self.size -= size
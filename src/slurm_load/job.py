@@ -1,18 +1,30 @@
 from typing import Any
 from slurm_topo.topology import Topology
-import numpy.random as rnd
+import numpy as np
 from datetime import time, timedelta
 
+CLASSIC = 0
+GPU = 1
+GENERIC = 2
+
+# Columns of JobTable.values, same order used by app.utils.vectorize_job
+N_TASKS = 0
+TASKS_PER_NODE = 1
+WALLTIME = 2
+MEM = 3
+GRES = 4
+
 class Job(object):
     '''
     Class Job: class for organizing all jobs in
     '''
 
-    def __init__(self, job_id:str, sim_walltime:int, uid:str, flags:list[str]):
+    def __init__(self, job_id:str, sim_walltime:int, uid:str, flags:list[str], values:list[int]=None):
         self.job_id = job_id
         self.sim_walltime = sim_walltime
         self.uid = uid
         self.flags = flags
+        self.values = values if values is not None else flags_values(flags)
 
     def __str__(self):
         base_job_str = f"-J {self.job_id} -sim-walltime {self.sim_walltime} --uid={self.uid}"
@@ -20,26 +32,261 @@ class Job(object):
             base_job_str = base_job_str + ' ' + option
         return base_job_str + ' pseudo.job'
 
+def flags_values(flags:list[str]) -> list[int]:
+    '''
+    Numeric resources of a job flag list: [n_tasks, tasks_per_node, walltime (sec.), mem, gres]
+    '''
+    values = [0] * 5
+    for flag in flags:
+        if flag.startswith('--'):
+            name, value = flag.split('=')
+        else:
+            name, value = flag.split(' ')
+        if name == '-n':
+            values[N_TASKS] = int(value)
+        if name == '--ntasks-per-node':
+            values[TASKS_PER_NODE] = int(value)
+        if name == '-t':
+            value = value.split(':')
+            values[WALLTIME] = int(timedelta(hours=int(value[0]), minutes=int(value[1]), seconds=int(value[2])).total_seconds())
+        if name == '--mem':
+            values[MEM] = int(value)
+        if name == '--gres':
+            values[GRES] = int(value.split(':')[1])
+    return values
+
+def flags_account(flags:list[str]) -> str:
+    for flag in flags:
+        if flag.startswith('-A '):
+            return flag[3:]
+    return ''
+
+def format_walltime(seconds:int) -> str:
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+class JobTable(object):
+    '''
+    Class JobTable: struct-of-arrays storage for a batch of jobs.
+    The numeric resources share a single (n, 5) int64 matrix, so the
+    per-field attributes are views over its columns.
+    '''
+
+    def __init__(self, td, job_id, uid, account, walltime, sim_walltime, n_tasks, tasks_per_node, mem, gres):
+        self.td = np.asarray(td, dtype=np.int64)
+        self.job_id = np.asarray(job_id, dtype=np.int64)
+        self.uid = np.asarray(uid, dtype=str)
+        self.account = np.asarray(account, dtype=str)
+        self.sim_walltime = np.asarray(sim_walltime, dtype=np.int64)
+        self.values = np.empty((len(self.job_id), 5), dtype=np.int64)
+        self.values[:, N_TASKS] = n_tasks
+        self.values[:, TASKS_PER_NODE] = tasks_per_node
+        self.values[:, WALLTIME] = walltime
+        self.values[:, MEM] = mem
+        self.values[:, GRES] = gres
+
+    @property
+    def n_tasks(self) -> np.ndarray:
+        return self.values[:, N_TASKS]
+
+    @property
+    def tasks_per_node(self) -> np.ndarray:
+        return self.values[:, TASKS_PER_NODE]
+
+    @property
+    def walltime(self) -> np.ndarray:
+        return self.values[:, WALLTIME]
+
+    @property
+    def mem(self) -> np.ndarray:
+        return self.values[:, MEM]
+
+    @property
+    def gres(self) -> np.ndarray:
+        return self.values[:, GRES]
+
+    @classmethod
+    def from_jobs(cls, jobs:list[tuple[int, Job]]) -> 'JobTable':
+        """
+        Build a table from the (submission time, Job) couples of WorkLoad.generate_workload
+        """
+        td = [td for td, _ in jobs]
+        job_id = [int(job.job_id.rsplit('_', 1)[-1]) for _, job in jobs]
+        uid = [job.uid for _, job in jobs]
+        account = [flags_account(job.flags) for _, job in jobs]
+        sim_walltime = [job.sim_walltime for _, job in jobs]
+        values = np.array([job.values for _, job in jobs], dtype=np.int64).reshape(-1, 5)
+        return cls(td, job_id, uid, account, values[:, WALLTIME], sim_walltime,
+                   values[:, N_TASKS], values[:, TASKS_PER_NODE], values[:, MEM], values[:, GRES])
+
+    def __len__(self):
+        return len(self.job_id)
+
+    def select(self, idx) -> 'JobTable':
+        '''
+        Table of the jobs at @idx (indices or boolean mask)
+        '''
+        return JobTable(self.td[idx], self.job_id[idx], self.uid[idx], self.account[idx], self.walltime[idx],
+                        self.sim_walltime[idx], self.n_tasks[idx], self.tasks_per_node[idx], self.mem[idx], self.gres[idx])
+
+    def __getitem__(self, i:int) -> tuple[int, Job]:
+        walltime = int(self.walltime[i])
+        req_time = time(hour=walltime // 3600, minute=walltime % 3600 // 60, second=walltime % 60)
+        account = str(self.account[i]) or None
+        flags = stringfy_flags(req_time, int(self.n_tasks[i]), int(self.tasks_per_node[i]), account,
+                               mem=int(self.mem[i]), gres=int(self.gres[i]))
+        job = Job(f"jobid_{self.job_id[i]}", int(self.sim_walltime[i]), str(self.uid[i]), flags, self.values[i].tolist())
+        return int(self.td[i]), job
+
+    def to_jobs(self) -> list[tuple[int, Job]]:
+        """
+        Materialize the table as the (submission time, Job) couples returned by WorkLoad.generate_workload
+        """
+        return [self[i] for i in range(len(self))]
+
+    def line(self, i:int, zero:bool=False) -> str:
+        """
+        Render the slurmsim submit_batch_job event of the i-th job
+
+        Args:
+            i (int): Job index
+            zero (bool, optional): Submit every job at time 0. Defaults to False.
+        """
+        td = 0 if zero else int(self.td[i])
+        return event_line(td, int(self.job_id[i]), int(self.sim_walltime[i]), str(self.uid[i]),
+                          str(self.account[i]), self.values[i].tolist())
+
+    def lines(self, zero:bool=False):
+        for i in range(len(self)):
+            yield self.line(i, zero)
+
+    def render(self, zero:bool=False) -> str:
+        """
+        All the submit_batch_job events of the table as a single block of text
+        """
+        td = np.zeros(len(self), dtype=np.int64) if zero else self.td
+        rows = zip(td.tolist(), self.job_id.tolist(), self.sim_walltime.tolist(), self.uid.tolist(),
+                   self.account.tolist(), self.values.tolist())
+        return ''.join([event_line(*row) + '\n' for row in rows])
+
+def event_line(td:int, job_id:int, sim_walltime:int, uid:str, account:str, values:list[int]) -> str:
+    n_tasks, tasks_per_node, walltime, mem, gres = values
+    line = (f"-dt {td} -e submit_batch_job | -J jobid_{job_id} -sim-walltime {sim_walltime} "
+            f"--uid={uid} -t {format_walltime(walltime)} -n {n_tasks} --ntasks-per-node={tasks_per_node}")
+    if account:
+        line += f" -A {account}"
+    line += " -p normal -q normal"
+    if mem > 0:
+        line += f" --mem={mem}"
+    if gres > 0:
+        line += f" --gres=gpu:{gres}"
+    return line + " pseudo.job"
+
+def stringfy_flags(req_time:time, n_tasks, tasks_nodes, account=None, constr=None, mem=0, gres=0) -> list[str]:
+    flags = []
+    req_time = req_time.strftime('%H:%M:%S')
+    flags.append(f'-t {req_time}')
+    flags.append(f'-n {n_tasks}')
+    flags.append(f'--ntasks-per-node={tasks_nodes}')
+    if account is not None:
+        flags.append(f'-A {account}')
+    flags.append(f'-p normal')
+    flags.append(f'-q normal')
+    if constr is not None:
+        flags.append(f'--constraint={constr}')
+    if mem > 0:
+        flags.append(f'--mem={mem}')
+    if gres > 0:
+        flags.append(f'--gres=gpu:{gres}')
+
+    return flags
+
+def job_values(req_time:time, n_tasks, tasks_nodes, mem=0, gres=0) -> list[int]:
+    walltime = req_time.hour * 3600 + req_time.minute * 60 + req_time.second
+    return [n_tasks, tasks_nodes, walltime, mem, gres]
+
+class FeasibleRegion:
+    '''
+    Class FeasibleRegion: the job requests that can run on a topology, as drawn by JobGenerator.
+
+    A request is a gres value gres[g] (gres[0] = 0, no gpus), a memory value mem[m]
+    (mem[0] = 0, default memory) and n tasks per node, uniform in [1, max_task]: it is
+    valid when at least two nodes can host it. The node count only decreases with
+    the tasks per node, so the valid requests of (g, m) are the tasks per node in
+    [1, max_procs[g, m]] (none when 0). For every job kind the (g, m) couple is drawn
+    with its probability times the fraction of valid tasks per node, then the tasks
+    per node uniformly in the valid range: the same jobs the old draw-and-retry
+    generation accepted, without rejections.
+    '''
+
+    def __init__(self, topology:Topology, max_task:int, max_gres:int, mem_low:int, mem_high:int):
+        self.gres = np.arange(max_gres + 1)
+        # mem is drawn uniform in [mem_low, mem_high) and floored to the thousand
+        if mem_high > mem_low:
+            self.mem = np.concatenate([[0], np.arange(mem_low - mem_low % 1000, mem_high, 1000)])
+            mem_p = np.minimum(self.mem[1:] + 1000, mem_high) - np.maximum(self.mem[1:], mem_low)
+            mem_p = mem_p / mem_p.sum()
+        else:
+            self.mem = np.zeros(1, dtype=np.int64)
+            mem_p = np.zeros(0)
+        gres_p = np.full(max_gres, 1 / max_gres) if max_gres > 0 else np.zeros(0)
+
+        procs = topology.procs_values
+        counts = topology.count_nodes_batch(self.gres[:, None, None], procs[None, None, :], self.mem[None, :, None])
+        self.max_procs = np.minimum(np.where(counts > 1, procs, 0).max(axis=2, initial=0), max_task)
+
+        # Probability of every (gres, mem) request, before the tasks per node
+        none = lambda n: np.eye(1, n)[0]
+        either = lambda p: np.concatenate([[0.5], 0.5 * p]) if len(p) > 0 else np.ones(1)
+        prior = {
+            CLASSIC: np.outer(none(len(self.gres)), none(len(self.mem))),
+            GPU: np.outer(np.concatenate([[0], gres_p]), none(len(self.mem))),
+            GENERIC: np.outer(either(gres_p), either(mem_p)),
+        }
+        self.cdf = {}
+        for kind, p in prior.items():
+            weight = (p * self.max_procs / max(max_task, 1)).ravel()
+            self.cdf[kind] = np.cumsum(weight) if weight.sum() > 0 else None
+        if self.cdf[CLASSIC] is None:
+            raise ValueError('no job fits on two nodes of the topology')
+
+    def sample(self, rng:np.random.Generator, kind:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        (g, m) indices of a request for each job @kind, GPU and GENERIC without a valid request fall back to CLASSIC
+        '''
+        kind = np.where([self.cdf[k] is None for k in kind], CLASSIC, kind) if len(kind) > 0 else kind
+        flat = np.zeros(len(kind), dtype=np.int64)
+        for k, cdf in self.cdf.items():
+            sel = np.flatnonzero(kind == k)
+            if len(sel) > 0:
+                flat[sel] = np.searchsorted(cdf, rng.random(len(sel)) * cdf[-1], side='right')
+        return np.unravel_index(flat, self.max_procs.shape)
+
 class JobGenerator:
     '''
     Class JobGenerator: a random job generator
     '''
 
-    def __init__(self, topology:Topology, max_long_job=24, max_short_job=60, min_mem = 1000, **kwargs):
+    def __init__(self, topology:Topology, max_long_job=24, max_short_job=60, min_mem = 1000, rng:np.random.Generator=None, **kwargs):
         self.max_long_job = max_long_job
         self.max_short_job = max_short_job
         self.topology = topology
         self.min_mem = min_mem
+        self.rng = np.random.default_rng() if rng is None else rng
+        # Feature -> FeasibleRegion, the topology does not change
+        self.regions = {}
 
-    def set_seed(seed:int):
-        rnd.seed(seed)
+    def set_seed(self, seed:int):
+        self.set_rng(np.random.default_rng(seed))
+
+    def set_rng(self, rng:np.random.Generator):
+        self.rng = rng
 
     def generate_time(self, minute_b:bool=False, hour_b=False) -> time:
-        hour = 0 if not hour_b or self.max_long_job <= 1 else rnd.randint(0, 24)
+        hour = 0 if not hour_b or self.max_long_job <= 1 else int(self.rng.integers(0, 24))
         if minute_b:
-            minute = 1 if self.max_short_job <= 1 else rnd.randint(1, self.max_short_job)
+            minute = 1 if self.max_short_job <= 1 else int(self.rng.integers(1, self.max_short_job))
         else:
-            minute = rnd.choice([0, 30]) if hour != 0 else rnd.randint(1, 60)
+            minute = int(self.rng.choice([0, 30])) if hour != 0 else int(self.rng.integers(1, 60))
 
         return time(
             hour=hour,
@@ -49,79 +296,100 @@ class JobGenerator:
     def generate_job_time(self, long:bool=False):
         req_time = self.generate_time(minute_b=not long, hour_b=long)
         req_time_s = timedelta(hours=req_time.hour, minutes=req_time.minute).total_seconds()
-        delta_time = rnd.randint(-1, min(req_time_s, 3600))
+        delta_time = int(self.rng.integers(-1, min(req_time_s, 3600)))
         sim_walltime = -1 if delta_time == -1 or delta_time == 0 else int(req_time_s - delta_time)
         return req_time, sim_walltime
 
-    def generate_job_tasks(self, max_task, args={}):
-        n_task_nodes = rnd.randint(1, max_task + 1)
-        num_nodes = self.topology.count_nodes(procs=n_task_nodes, **args)
-        if num_nodes == 0 or num_nodes == 1:
-            return 0, 0
-        n_tasks = rnd.randint(1, num_nodes) * n_task_nodes
-        return n_task_nodes, n_tasks
-    
+    def feasible_region(self, feat='DEFAULT') -> 'FeasibleRegion':
+        '''
+        FeasibleRegion of the jobs targeting @feat, built once from the topology
+        '''
+        if feat not in self.regions:
+            max_gres = self.topology.max_gres[feat] if self.topology.max_gres[feat] != 0 else self.topology.max_gres['ALL']
+            mem_high = int(self.topology.max_mem[feat] * 4 / 5)
+            self.regions[feat] = FeasibleRegion(self.topology, self.topology.max_tasks_node[feat], max_gres, self.min_mem, mem_high)
+        return self.regions[feat]
+
     def stringfy_flags(self, req_time:time, n_tasks, tasks_nodes, account=None, constr=None, mem=0, gres=0) -> list[str]:
-        flags = []
-        req_time = req_time.strftime('%H:%M:%S')
-        flags.append(f'-t {req_time}')
-        flags.append(f'-n {n_tasks}')
-        flags.append(f'--ntasks-per-node={tasks_nodes}')
-        if account is not None:
-            flags.append(f'-A {account}')
-        flags.append(f'-p normal')
-        flags.append(f'-q normal')
-        if constr is not None:
-            flags.append(f'--constraint={constr}')
-        if mem > 0:
-            flags.append(f'--mem={mem}')
-        if gres > 0:
-            flags.append(f'--gres=gpu:{gres}')
-        
-        return flags
-    
-    def generate_classic_job(self, job_id:str, user_id:str, account:str, long:bool=True, feat='DEFAULT'):
+        return stringfy_flags(req_time, n_tasks, tasks_nodes, account, constr, mem, gres)
+
+    def generate_job(self, kind:int, job_id:str, user_id:str, account:str, long:bool, feat='DEFAULT') -> Job:
+        """
+        Draw a job of type @kind from the feasible region: every draw is a valid job.
+        A GPU or GENERIC job that cannot run on the topology is drawn as CLASSIC.
+
+        Args:
+            kind (int): CLASSIC, GPU or GENERIC
+            job_id (str): job name
+            user_id (str): submitting user
+            account (str): user account
+            long (bool): draw the time limit in hours instead of minutes
+            feat (str, optional): Node feature the job targets. Defaults to 'DEFAULT'.
+
+        Returns:
+            Job: the job
+        """
         req_time, sim_walltime = self.generate_job_time(long)
-        n_task_nodes, n_tasks = self.generate_job_tasks(self.topology.max_tasks_node[feat])
-        if n_task_nodes == 0:
-            return None
-        flags = self.stringfy_flags(req_time, n_tasks, n_task_nodes, account)
-        return Job(job_id, sim_walltime, user_id, flags)
-    
-    def generate_gres(self, feat):
-        if self.topology.max_gres[feat] == 0:
-            return rnd.randint(1, self.topology.max_gres['ALL'] + 1) if self.topology.max_gres['ALL'] != 0 else 0
-        else:
-            return rnd.randint(1, self.topology.max_gres[feat] + 1)
+        region = self.feasible_region(feat)
+        g, m = region.sample(self.rng, np.array([kind]))
+        gres, mem = int(region.gres[g[0]]), int(region.mem[m[0]])
+        n_task_nodes = int(self.rng.integers(1, region.max_procs[g[0], m[0]] + 1))
+        num_nodes = self.topology.count_nodes(procs=n_task_nodes, gres=gres, mem=mem)
+        n_tasks = int(self.rng.integers(1, num_nodes)) * n_task_nodes
+        flags = self.stringfy_flags(req_time, n_tasks, n_task_nodes, account, mem=mem, gres=gres)
+        return Job(job_id, sim_walltime, user_id, flags, job_values(req_time, n_tasks, n_task_nodes, mem=mem, gres=gres))
+
+    def generate_classic_job(self, job_id:str, user_id:str, account:str, long:bool=True, feat='DEFAULT'):
+        return self.generate_job(CLASSIC, job_id, user_id, account, long, feat)
 
     def generate_gpu_job(self, job_id:str, user_id:str, account:str, long:bool=True, feat='DEFAULT'):
-        req_time, sim_walltime = self.generate_job_time(long)
-        gres = self.generate_gres(feat)
-        n_task_nodes, n_tasks = self.generate_job_tasks(self.topology.max_tasks_node[feat], {'gres':gres})
-        if n_task_nodes == 0:
-            return None
-        num_nodes = n_tasks // n_task_nodes
-        if num_nodes < self.topology.count_nodes(procs=n_task_nodes, gres=gres):
-            return None
-        flags = self.stringfy_flags(req_time, n_tasks, n_task_nodes, account, gres=gres)
-        return Job(job_id, sim_walltime, user_id, flags)
-    
-    def generate_mem(self, feat):
-        mem = rnd.randint(self.min_mem, int(self.topology.max_mem[feat] * 4 / 5))
-        mem -= mem % 1000
-        return mem
+        return self.generate_job(GPU, job_id, user_id, account, long, feat)
 
     def generate_generic_job(self, job_id:str, user_id:str, account:str, long:bool=False, feat='DEFAULT'):
-        req_time, sim_walltime = self.generate_job_time(long)
-        param = {}
-        if rnd.choice([True, False]):
-            gres = self.generate_gres(feat)
-            param['gres'] = gres
-        if rnd.choice([True, False]):
-            mem = self.generate_mem(feat)
-            param['mem'] = mem
-        n_task_nodes, n_tasks = self.generate_job_tasks(self.topology.max_tasks_node[feat], param)
-        if n_task_nodes == 0:
-            return None
-        flags = self.stringfy_flags(req_time, n_tasks, n_task_nodes, account, **param)
-        return Job(job_id, sim_walltime, user_id, flags)
+        return self.generate_job(GENERIC, job_id, user_id, account, long, feat)
+
+
+    # Batched counterpart of the generators above: draws the values of @n jobs at once
+
+    def generate_job_time_batch(self, long:np.ndarray):
+        n = len(long)
+        hour = np.zeros(n, dtype=np.int64) if self.max_long_job <= 1 else self.rng.integers(0, 24, size=n)
+        hour = np.where(long, hour, 0)
+        if self.max_short_job <= 1:
+            short_minute = np.ones(n, dtype=np.int64)
+        else:
+            short_minute = self.rng.integers(1, self.max_short_job, size=n)
+        long_minute = np.where(hour != 0, self.rng.choice([0, 30], size=n), self.rng.integers(1, 60, size=n))
+        minute = np.where(long, long_minute, short_minute)
+        req_time_s = hour * 3600 + minute * 60
+        delta_time = self.rng.integers(-1, np.minimum(req_time_s, 3600))
+        sim_walltime = np.where(delta_time <= 0, -1, req_time_s - delta_time)
+        return req_time_s, sim_walltime
+
+    def generate_jobs_batch(self, kind:np.ndarray, feat='DEFAULT') -> dict[str, np.ndarray]:
+        """
+        Draw one job for each entry of @kind (CLASSIC, GPU or GENERIC), all valid.
+        As in generate_job, GPU and GENERIC jobs that cannot run are drawn as CLASSIC.
+
+        Args:
+            kind (np.ndarray): job type of every draw
+            feat (str, optional): Node feature the jobs target. Defaults to 'DEFAULT'.
+
+        Returns:
+            dict[str, np.ndarray]: job columns
+        """
+        region = self.feasible_region(feat)
+        walltime, sim_walltime = self.generate_job_time_batch(kind != GENERIC)
+        g, m = region.sample(self.rng, kind)
+        gres, mem = region.gres[g], region.mem[m]
+        n_task_nodes = self.rng.integers(1, region.max_procs[g, m] + 1)
+        num_nodes = self.topology.count_nodes_batch(gres, n_task_nodes, mem)
+        n_tasks = self.rng.integers(1, num_nodes) * n_task_nodes
+        return {
+            'walltime': walltime,
+            'sim_walltime': sim_walltime,
+            'n_tasks': n_tasks,
+            'tasks_per_node': n_task_nodes,
+            'mem': mem,
+            'gres': gres,
+        }
@@ -1,4 +1,4 @@
-import numpy.random as rnd
+import numpy as np
 
 class User(object):
     '''
@@ -27,7 +27,7 @@ class UserGenerator(object):
     Class UserGenerator: A simple generator for users
     '''
 
-    def __init__(self, min_usr:int=4, max_usr:int=8, min_group:int=2, max_group:int=4, **kwargs):
+    def __init__(self, min_usr:int=4, max_usr:int=8, min_group:int=2, max_group:int=4, rng:np.random.Generator=None, **kwargs):
         if min_usr > max_usr:
             raise ValueError("min_usr cannot be greater than max_usr")
         if min_group > max_group:
@@ -36,16 +36,20 @@ class UserGenerator(object):
         self.max_usr = max_usr
         self.min_group = min_group
         self.max_group = max_group 
+        self.rng = np.random.default_rng() if rng is None else rng
         
     def set_seed(self, seed:int):
-        rnd.seed(seed)
+        self.set_rng(np.random.default_rng(seed))
+
+    def set_rng(self, rng:np.random.Generator):
+        self.rng = rng
 
     def generate_users(self) -> tuple[set[User], int]:
-        n_group = rnd.randint(self.min_group, self.max_group)
+        n_group = int(self.rng.integers(self.min_group, self.max_group))
         users = set([User()])
-        n_account = rnd.randint(self.min_usr, self.max_usr)
+        n_account = int(self.rng.integers(self.min_usr, self.max_usr))
         for i in range(1, n_account):
-            gr_i = rnd.randint(1, n_group)
+            gr_i = int(self.rng.integers(1, n_group))
             usr = f'user{i}'
             usr_id = 1000 + i
             group = f'group{gr_i}'
@@ -53,8 +57,9 @@ class UserGenerator(object):
             users.add(User(usr, usr_id, group, group_id))
         return users, n_group
     
-def account_gen(users:User, n_account:int):
+def account_gen(users:User, n_account:int, rng:np.random.Generator=None):
+    rng = np.random.default_rng() if rng is None else rng
     accounts = {}
     for i, user in enumerate(users):
-        accounts[user.usr] = f"account{rnd.randint(1, n_account + 1)}"
+        accounts[user.usr] = f"account{rng.integers(1, n_account + 1)}"
     return accounts
\ No newline at end of file
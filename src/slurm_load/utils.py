@@ -1,4 +1,8 @@
+import re
+import numpy as np
+
 from slurm_load.user import User
+from slurm_load.job import JobTable
 
 def read_users_sim(p='tests/users.sim') -> list[User]:
     user_list = []
@@ -16,4 +20,55 @@ def read_users_sim(p='tests/users.sim') -> list[User]:
 def print_users_sim(p, users:set[User]):
     with open(p, mode='w') as f:
         lines = [repr(user) + '\n' for user in users]
-        f.writelines(lines)
\ No newline at end of file
+        f.writelines(lines)
+
+def print_events(p, jobs, zero:bool=False, buffering:int=1 << 20):
+    """
+    Write a workload as slurmsim submit_batch_job events.
+
+    Args:
+        p: Destination file
+        jobs: a JobTable, an iterable of JobTable chunks (e.g. WorkLoad.iter_workload)
+            or a list of (submission time, Job) couples
+        zero (bool, optional): Submit every job at time 0. Defaults to False.
+        buffering (int, optional): Size of the write buffer in bytes. Defaults to 1MiB.
+    """
+    if isinstance(jobs, JobTable):
+        jobs = [jobs]
+    with open(p, mode='w', buffering=buffering) as f:
+        for chunk in jobs:
+            if isinstance(chunk, JobTable):
+                f.write(chunk.render(zero))
+            else:
+                td, job = chunk
+                f.write(f"-dt {0 if zero else td} -e submit_batch_job | {job}\n")
+
+# A submit_batch_job line as written by JobTable.render and print_events
+EVENT_RX = re.compile(
+    r'-dt (?P<td>-?\d+) -e submit_batch_job \| -J jobid_(?P<job_id>\d+) -sim-walltime (?P<sim>-?\d+) --uid=(?P<uid>\S+) '
+    r'-t (?P<h>\d+):(?P<m>\d+):(?P<s>\d+) -n (?P<n>\d+) --ntasks-per-node=(?P<tpn>\d+)'
+    r'(?: -A (?P<account>\S+))? -p \S+ -q \S+(?: --constraint=\S+)?(?: --mem=(?P<mem>\d+))?(?: --gres=gpu:(?P<gres>\d+))? pseudo\.job'
+)
+
+def read_events_table(p) -> JobTable:
+    """
+    Read back the events file of print_events as a JobTable.
+
+    Args:
+        p: events file
+
+    Returns:
+        JobTable: the submitted jobs, in file order
+    """
+    with open(p, mode='r') as f:
+        lines = [line.rstrip('\r\n') for line in f if line.strip()]
+    rows = []
+    for i, line in enumerate(lines):
+        match = EVENT_RX.fullmatch(line)
+        if match is None:
+            raise ValueError(f'{p}:{i + 1}: not a submit_batch_job event')
+        rows.append(match.groupdict())
+    number = lambda key: np.array([int(row[key] or 0) for row in rows], dtype=np.int64)
+    walltime = number('h') * 3600 + number('m') * 60 + number('s')
+    return JobTable(number('td'), number('job_id'), [row['uid'] for row in rows], [row['account'] or '' for row in rows],
+                    walltime, number('sim'), number('n'), number('tpn'), number('mem'), number('gres'))
@@ -0,0 +1,133 @@
+import numpy as np
+
+from slurm_topo.topology import Topology
+from slurm_load.job import JobTable, N_TASKS, TASKS_PER_NODE, MEM, GRES
+from slurm_load.utils import read_events_table, print_events
+from slurm_sim.simulator import DEF_MEM_PER_CPU
+
+# What to do with the jobs that can never start
+REJECT = 'reject'
+REPAIR = 'repair'
+
+class WorkloadValidator:
+    '''
+    Class WorkloadValidator: finds the jobs of a workload that no set of nodes of the
+    topology can ever host, so that slurm would keep them pending until the simulation
+    times out.
+
+    A job needs ceil(n_tasks / tasks_per_node) nodes, each with tasks_per_node cores,
+    its gpus and its memory (--mem, or tasks_per_node * DefMemPerCPU). The whole
+    workload is checked at once with Topology.count_nodes_batch. Feature constraints
+    are not checked: JobTable does not hold them and the generated jobs have none.
+    '''
+
+    def __init__(self, topology:Topology, def_mem_per_cpu:int=DEF_MEM_PER_CPU):
+        self.topology = topology
+        self.def_mem_per_cpu = def_mem_per_cpu
+
+    def node_mem(self, tasks_per_node:np.ndarray, mem:np.ndarray) -> np.ndarray:
+        return np.where(mem > 0, mem, tasks_per_node * self.def_mem_per_cpu)
+
+    def hosts(self, gres:np.ndarray, tasks_per_node:np.ndarray, mem:np.ndarray) -> np.ndarray:
+        '''
+        Number of nodes able to host the share of one node of each job
+        '''
+        return self.topology.count_nodes_batch(gres, tasks_per_node, self.node_mem(tasks_per_node, mem))
+
+    def feasible(self, table:JobTable) -> np.ndarray:
+        """
+        Jobs that can start on the empty cluster.
+
+        Args:
+            table (JobTable): the workload
+
+        Returns:
+            np.ndarray: one bool for every job
+        """
+        tasks_per_node = np.maximum(table.tasks_per_node, 1)
+        need = -(-table.n_tasks // tasks_per_node)
+        return (table.tasks_per_node > 0) & (table.n_tasks > 0) & (self.hosts(table.gres, tasks_per_node, table.mem) >= need)
+
+    def repair(self, table:JobTable) -> tuple[JobTable, np.ndarray]:
+        """
+        Shrink the requests of the impossible jobs until they fit: gpus are capped to the
+        largest node, a memory no node offers falls back to the default one, tasks per
+        node are capped to the largest host and the tasks to the hosts available.
+
+        Args:
+            table (JobTable): the workload
+
+        Returns:
+            tuple[JobTable, np.ndarray]: the repaired workload (same jobs, same order) and
+                the jobs that cannot be repaired (no node at all can host them)
+        """
+        bad = np.flatnonzero(~self.feasible(table))
+        table = table.select(np.arange(len(table)))
+        if len(bad) == 0:
+            return table, np.zeros(len(table), dtype=bool)
+        n_tasks, tasks_per_node = np.maximum(table.n_tasks[bad], 1), np.maximum(table.tasks_per_node[bad], 1)
+        gres = np.minimum(table.gres[bad], self.topology.max_gres['ALL'])
+        mem = table.mem[bad]
+        mem = np.where((mem > 0) & (self.topology.count_nodes_batch(gres, 1, mem) == 0), 0, mem)
+
+        # Largest tasks per node with a host, over the distinct core counts of the nodes
+        procs = self.topology.procs_values
+        hosted = self.hosts(gres[:, None], procs[None, :], mem[:, None]) > 0
+        max_procs = np.where(hosted, procs, 0).max(axis=1, initial=0)
+        tasks_per_node = np.maximum(np.minimum(tasks_per_node, max_procs), 1)
+        hosts = self.hosts(gres, tasks_per_node, mem)
+        n_tasks = np.where(-(-n_tasks // tasks_per_node) > hosts, hosts * tasks_per_node, n_tasks)
+
+        table.values[bad, N_TASKS] = n_tasks
+        table.values[bad, TASKS_PER_NODE] = tasks_per_node
+        table.values[bad, MEM] = mem
+        table.values[bad, GRES] = gres
+        lost = np.zeros(len(table), dtype=bool)
+        lost[bad] = max_procs == 0
+        return table, lost
+
+    def validate(self, table:JobTable, mode:str=REPAIR) -> tuple[JobTable, dict]:
+        """
+        Reject or repair the impossible jobs of a workload.
+
+        Args:
+            table (JobTable): the workload
+            mode (str, optional): REJECT drops the impossible jobs, REPAIR shrinks them
+                (and drops the ones that cannot be repaired). Defaults to REPAIR.
+
+        Returns:
+            tuple[JobTable, dict]: the valid workload and the number of 'jobs', 'invalid',
+                'repaired' and 'rejected' jobs
+        """
+        if mode not in (REJECT, REPAIR):
+            raise ValueError(f'unknown validation mode {mode}')
+        ok = self.feasible(table)
+        report = {'jobs': len(table), 'invalid': int((~ok).sum()), 'repaired': 0, 'rejected': 0}
+        if ok.all():
+            return table, report
+        if mode == REPAIR:
+            table, lost = self.repair(table)
+            report['repaired'] = int((~ok & ~lost).sum())
+            ok = ~lost
+        report['rejected'] = int((~ok).sum())
+        return table.select(ok), report
+
+def validate_events(path, topology:Topology, mode:str=REPAIR, def_mem_per_cpu:int=DEF_MEM_PER_CPU) -> tuple[JobTable, dict]:
+    """
+    Validate an events file in place, it is rewritten only when some job changes.
+
+    Args:
+        path: events file (workload/first_job.events)
+        topology (Topology): the cluster, e.g. from etc/slurm.conf
+        mode (str, optional): REJECT or REPAIR, see WorkloadValidator.validate. Defaults to REPAIR.
+        def_mem_per_cpu (int, optional): DefMemPerCPU of the cluster. Defaults to DEF_MEM_PER_CPU.
+
+    Returns:
+        tuple[JobTable, dict]: the validated workload, as written in the file, and the
+            report of WorkloadValidator.validate
+    """
+    table = read_events_table(path)
+    table, report = WorkloadValidator(topology, def_mem_per_cpu).validate(table, mode)
+    if report['invalid'] > 0:
+        print_events(path, table)
+    return table, report
@@ -1,6 +1,10 @@
-import numpy.random as rnd
+import copy
+import os
+import numpy as np
 
-from slurm_load.job import Job, JobGenerator
+from concurrent.futures import ProcessPoolExecutor
+
+from slurm_load.job import Job, JobGenerator, JobTable, CLASSIC, GPU, GENERIC
 from slurm_load.user import User
 from slurm_load.utils import read_users_sim, print_users_sim
 
@@ -12,10 +16,15 @@ class WorkLoad(object):
     '''
 
     def __init__(self, users:list[User], accounts:dict, job_gen:JobGenerator, 
-                 dt_range:int|list[int] = [1800, 6000], probability:list = [0.7, 0.9], retry = 5, **kwargs):
+                 dt_range:int|list[int] = [1800, 6000], probability:list = [0.7, 0.9], retry = 5, rng:np.random.Generator=None, **kwargs):
         self.users = users
         self.accounts = accounts
         self.job_gen = job_gen
+        # A single stream for the workload and its jobs, the one of job_gen unless given
+        if rng is not None:
+            self.set_rng(rng)
+        else:
+            self.rng = job_gen.rng
 
         self.ts = 0
         self.jb_id = 1
@@ -24,11 +33,25 @@ class WorkLoad(object):
         else:
             self.dt_range = dt_range
         self.probability = probability
+        # No longer used: jobs are drawn from the feasible region of the topology
         self.retry = retry
         
     
     def set_seed(self, seed:int):
-        rnd.seed(seed)
+        self.set_rng(np.random.default_rng(seed))
+
+    def set_rng(self, rng:np.random.Generator):
+        self.rng = rng
+        self.job_gen.set_rng(rng)
+
+    def spawn(self, rng:np.random.Generator) -> 'WorkLoad':
+        '''
+        Copy of the generator drawing from @rng, users, accounts and topology are shared
+        '''
+        workload = copy.copy(self)
+        workload.job_gen = copy.copy(self.job_gen)
+        workload.set_rng(rng)
+        return workload
     
     def reset(self):
         '''
@@ -39,27 +62,21 @@ class WorkLoad(object):
 
     def generate_job(self) -> tuple[int, Job]:
         td = self.ts
-        user:User = rnd.choice(self.users)
+        user:User = self.users[self.rng.integers(len(self.users))]
         user_id = user.usr
         account = self.accounts[user_id]
         job_id = f"jobid_{self.jb_id + 1000}"
-        val = rnd.rand()
+        val = self.rng.random()
         if val < self.probability[0]:
             gen = self.job_gen.generate_classic_job
         elif val < self.probability[1]:
             gen = self.job_gen.generate_gpu_job
         else:
             gen = self.job_gen.generate_generic_job
+        # Jobs are drawn from the feasible region of the topology: no retries
+        job = gen(job_id, user_id, account)
         
-        for i in range(self.retry):
-            job = gen(job_id, user_id, account)
-            if job is not None:
-                break
-        else:
-            while job is None:
-                job = self.job_gen.generate_classic_job(job_id, user_id, account)
-        
-        self.ts += rnd.randint(low=self.dt_range[0], high=self.dt_range[1])
+        self.ts += int(self.rng.integers(low=self.dt_range[0], high=self.dt_range[1]))
         self.jb_id += 1
         return td, job
     
@@ -81,6 +98,53 @@ class WorkLoad(object):
             workload.append((td, job))
         return workload
 
+    def generate_workload_batch(self, num:int, reset:bool=True) -> JobTable:
+        """
+        Generate a workload with @num jobs drawing every field for all the jobs at once.
+        Jobs follow the same distributions of generate_workload, but they are kept in
+        columnar form: use JobTable.to_jobs to get the (td, Job) couples.
+
+        Args:
+            num (int): Jobs number
+            reset (bool, optional): Reset the internal state of the machine at the beginning. Defaults to True.
+
+        Returns:
+            JobTable: the generated jobs
+        """
+        if reset: self.reset()
+        user_idx = self.rng.integers(0, len(self.users), size=num)
+        val = self.rng.random(num)
+        kind = np.where(val < self.probability[0], CLASSIC, np.where(val < self.probability[1], GPU, GENERIC))
+
+        columns = self.job_gen.generate_jobs_batch(kind)
+
+        dt = self.rng.integers(low=self.dt_range[0], high=self.dt_range[1], size=num)
+        td = self.ts + np.cumsum(dt) - dt
+        job_id = self.jb_id + 1000 + np.arange(num)
+        self.ts += int(dt.sum())
+        self.jb_id += num
+
+        uid = np.array([user.usr for user in self.users])[user_idx]
+        account = np.array([self.accounts[user.usr] for user in self.users])[user_idx]
+        return JobTable(td, job_id, uid, account, **columns)
+
+    def iter_workload(self, num:int, chunk_size:int=65536, reset:bool=True):
+        """
+        Lazily generate a workload with @num jobs, @chunk_size jobs at a time.
+        Only one chunk is alive at once, so memory does not grow with @num.
+
+        Args:
+            num (int): Jobs number
+            chunk_size (int, optional): Jobs per chunk. Defaults to 65536.
+            reset (bool, optional): Reset the internal state of the machine at the beginning. Defaults to True.
+
+        Yields:
+            JobTable: the next chunk of jobs
+        """
+        if reset: self.reset()
+        for start in range(0, num, chunk_size):
+            yield self.generate_workload_batch(min(chunk_size, num - start), reset=False)
+
 
     def reset(self, seed:int=None):
         self.ts = 0
@@ -88,4 +152,37 @@ class WorkLoad(object):
         if seed is not None:
             self.set_seed(seed)
 
+# WorkLoad of the worker processes of generate_workloads, sent once by the pool initializer
+_worker_workload = None
+
+def _init_worker(workload:WorkLoad):
+    global _worker_workload
+    _worker_workload = workload
+
+def _generate(seed:np.random.SeedSequence, num:int, workload:WorkLoad=None) -> JobTable:
+    workload = _worker_workload if workload is None else workload
+    return workload.spawn(np.random.default_rng(seed)).generate_workload_batch(num)
+
+def generate_workloads(workload:WorkLoad, k:int, num:int, seed:int|np.random.SeedSequence=None, workers:int=None) -> list[JobTable]:
+    """
+    Generate @k workloads of @num jobs over a process pool.
+    Workload i draws from the i-th stream spawned by SeedSequence(@seed): the result
+    depends only on the seed, not on the number of workers or on the scheduling.
+
+    Args:
+        workload (WorkLoad): generator of the users, accounts and topology of the workloads
+        k (int): number of workloads
+        num (int): jobs of every workload
+        seed (int | np.random.SeedSequence, optional): root seed. Defaults to None (fresh entropy).
+        workers (int, optional): size of the process pool, 1 to generate in process. Defaults to the number of cpus.
 
+    Returns:
+        list[JobTable]: the k workloads, in stream order
+    """
+    seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    seeds = seed.spawn(k)
+    workers = os.cpu_count() if workers is None else workers
+    if workers <= 1 or k <= 1:
+        return [_generate(child, num, workload) for child in seeds]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(workload,)) as pool:
+        return list(pool.map(_generate, seeds, [num] * k, chunksize=max(1, k // (workers * 4))))
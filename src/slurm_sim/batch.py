@@ -0,0 +1,225 @@
+import numpy as np
+
+from slurm_topo.topology import Topology
+from slurm_load.job import JobTable
+from slurm_sim.simulator import Cluster, DEF_MEM_PER_CPU
+
+class BatchSimulator:
+    '''
+    Class BatchSimulator: the scheduling of slurm_sim.simulator.Simulator (FCFS with EASY
+    backfill, per node core, memory and gpu accounting) run on B workloads at once.
+
+    The B envs advance in lock-step: at every iteration each env moves its clock to its
+    next job end or submission and runs one scheduling pass, as Simulator.schedule: the
+    queued jobs are visited in queue order, the k-th queued job of every env at once,
+    starting them while they fit, then backfilling the next ones behind the reservation
+    of the first that does not. All the state lives in (B, ...) arrays: free resources
+    (B, 3, nodes), job allocations (B, jobs, nodes) and job times (B, jobs).
+    Jobs request no features, as the workloads of WorkLoad.generate_workload_batch.
+    '''
+
+    def __init__(self, topology:Topology, def_mem_per_cpu:int=DEF_MEM_PER_CPU, max_job_test:int=1200):
+        self.cluster = Cluster(topology.nodes, def_mem_per_cpu)
+        self.def_mem_per_cpu = def_mem_per_cpu
+        self.max_job_test = max_job_test
+
+    def run(self, submit:np.ndarray, limit:np.ndarray, duration:np.ndarray, n_tasks:np.ndarray,
+            tasks_per_node:np.ndarray, mem:np.ndarray, gres:np.ndarray, valid:np.ndarray=None) -> np.ndarray:
+        """
+        Simulate B workloads of (at most) J jobs.
+
+        Args:
+            submit (np.ndarray): (B, J) submission times
+            limit (np.ndarray): (B, J) time limits, in seconds
+            duration (np.ndarray): (B, J) run times, in seconds (at most the time limit)
+            n_tasks (np.ndarray): (B, J) number of tasks
+            tasks_per_node (np.ndarray): (B, J) tasks on each node
+            mem (np.ndarray): (B, J) memory on each node, 0 for DefMemPerCPU
+            gres (np.ndarray): (B, J) gpus on each node
+            valid (np.ndarray, optional): (B, J) False for padding. Defaults to all True.
+
+        Returns:
+            np.ndarray: (B, J) float64 start times, NaN for padding and for the jobs
+                rejected because they could not run on the empty cluster
+        """
+        submit, limit, duration, n_tasks, tasks_per_node, mem, gres = [
+            np.asarray(x, dtype=np.int64) for x in (submit, limit, duration, n_tasks, tasks_per_node, mem, gres)]
+        B, J = submit.shape
+        valid = np.ones((B, J), dtype=bool) if valid is None else np.asarray(valid, dtype=bool)
+
+        # Queue order: submission time, then position
+        order = np.argsort(np.where(valid, submit, np.iinfo(np.int64).max), axis=1, kind='stable')
+        take = lambda x: np.take_along_axis(x, order, axis=1)
+        submit, limit, duration, valid = take(submit), take(limit), take(duration), take(valid)
+        need = take(-(-n_tasks // np.maximum(tasks_per_node, 1)))
+        req = np.stack([tasks_per_node, np.where(mem > 0, mem, tasks_per_node * self.def_mem_per_cpu), gres], axis=2)
+        req = np.take_along_axis(req, order[:, :, None], axis=1).astype(np.int32)
+
+        capacity = self.cluster.capacity.astype(np.int32)
+        alive = valid & (self.room(capacity[None, None], req) >= need)
+        free = np.broadcast_to(capacity, (B,) + capacity.shape).copy()
+        alloc = np.zeros((B, J, capacity.shape[1]), dtype=bool)
+        started = np.zeros((B, J), dtype=bool)
+        released = np.zeros((B, J), dtype=bool)
+        start = np.zeros((B, J), dtype=np.int64)
+        end = np.full((B, J), np.iinfo(np.int64).max, dtype=np.int64)
+        state = {'free': free, 'alloc': alloc, 'started': started, 'released': released, 'start': start, 'end': end}
+        now = np.where(alive.any(axis=1), submit[np.arange(B), np.argmax(alive, axis=1)], 0)
+
+        while True:
+            pending = alive & ~started
+            env = np.flatnonzero(pending.any(axis=1))
+            if len(env) == 0:
+                break
+            t = now[env]
+
+            # Jobs ended by now give their resources back
+            ended = started[env] & ~released[env] & (end[env] <= t[:, None])
+            if ended.any():
+                b, j = np.nonzero(ended)
+                b = env[b]
+                # An env can release several jobs at once
+                np.add.at(free, b, alloc[b, j][:, None, :] * req[b, j][:, :, None])
+                released[b, j] = True
+
+            queued = pending[env] & (submit[env] <= t[:, None])
+            self.schedule(env, t, queued, state, limit, duration, req, need)
+
+            # Next job end or submission
+            next_end = np.where(started[env] & ~released[env], end[env], np.iinfo(np.int64).max).min(axis=1)
+            next_submit = np.where(pending[env] & (submit[env] > t[:, None]), submit[env], np.iinfo(np.int64).max).min(axis=1)
+            now[env] = np.minimum(next_end, next_submit)
+
+        result = np.where(started, start, np.nan)
+        out = np.empty_like(result)
+        np.put_along_axis(out, order, result, axis=1)
+        return out
+
+    def schedule(self, env:np.ndarray, t:np.ndarray, queued:np.ndarray, state:dict, limit, duration, req, need):
+        '''
+        One scheduling pass at time @t of each env in @env, over its @queued (len(env), J) jobs
+        '''
+        free, alloc, started = state['free'], state['alloc'], state['started']
+        n = len(env)
+        # Positions of the queued jobs of every env, in queue order
+        queue = np.argsort(~queued, axis=1, kind='stable')
+        length = queued.sum(axis=1)
+        # Once the head of the queue does not fit: its position, reservation time and the resources free then
+        blocked = np.zeros(n, dtype=bool)
+        head = np.zeros(n, dtype=np.int64)
+        head_rank = np.zeros(n, dtype=np.int64)
+        reserved = np.zeros(n, dtype=bool)
+        shadow = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+        shadow_free = np.zeros((n,) + free.shape[1:], dtype=np.int32)
+
+        for k in range(int(length.max(initial=0))):
+            # As bf_max_job_test, a backfill pass looks at the first max_job_test jobs behind the head
+            scan = np.flatnonzero((k < length) & (~blocked | (k - head_rank < self.max_job_test)))
+            if len(scan) == 0:
+                break
+            b, j = env[scan], queue[scan, k]
+            nodes = self.fit(free[b], req[b, j], need[b, j])
+            go = nodes.any(axis=1)
+
+            stop = ~blocked[scan] & ~go
+            if stop.any():
+                h = scan[stop]
+                blocked[h], head[h], head_rank[h] = True, j[stop], k
+            # The reservation is only needed once some job behind the head fits,
+            # nothing has been backfilled yet: it is the one at the time the head stopped
+            new = go & blocked[scan] & ~reserved[scan]
+            if new.any():
+                h = scan[new]
+                reserved[h] = True
+                shadow[h], shadow_free[h] = self.reservation(env[h], head[h], state, limit, req, need)
+
+            # Backfilled jobs running past the reservation must leave room for the head job
+            late = np.flatnonzero(go & blocked[scan] & (t[scan] + limit[b, j] > shadow[scan]))
+            if len(late) > 0:
+                h = scan[late]
+                left = shadow_free[h] - nodes[late][:, None, :] * req[b[late], j[late]][:, :, None]
+                ok = self.room(left, req[env[h], head[h]]) >= need[env[h], head[h]]
+                go[late[~ok]] = False
+                shadow_free[h[ok]] = left[ok]
+
+            b, j, nodes = b[go], j[go], nodes[go]
+            alloc[b, j] = nodes
+            free[b] -= nodes[:, None, :] * req[b, j][:, :, None]
+            started[b, j] = True
+            state['start'][b, j] = t[scan[go]]
+            state['end'][b, j] = t[scan[go]] + duration[b, j]
+
+    @staticmethod
+    def room(free:np.ndarray, req:np.ndarray) -> np.ndarray:
+        '''
+        Number of nodes where @req (..., 3) fits, given the @free (..., 3, nodes) resources
+        '''
+        return (free >= req[..., None]).all(axis=-2).sum(axis=-1)
+
+    @staticmethod
+    def fit(free:np.ndarray, req:np.ndarray, need:np.ndarray) -> np.ndarray:
+        '''
+        (n, nodes) first-fit node selection of one job (@req (n, 3), @need nodes) on each
+        @free (n, 3, nodes), all False for the jobs that do not fit
+        '''
+        ok = (free >= req[..., None]).all(axis=-2)
+        taken = np.cumsum(ok, axis=-1, dtype=np.int32)
+        return ok & (taken <= need[..., None]) & (taken[..., -1:] >= need[..., None])
+
+    def reservation(self, env:np.ndarray, head:np.ndarray, state:dict, limit, req, need):
+        '''
+        As Simulator.reservation: earliest start of the @head job of each env by the time limits
+        of its running jobs, and the free resources at that time
+        '''
+        n = len(env)
+        idx = np.arange(n)
+        running = state['started'][env] & ~state['released'][env]
+        planned = np.where(running, state['start'][env] + limit[env], np.iinfo(np.int64).max)
+        # Running jobs first, in order of planned end: the others never free anything
+        by_end = np.argsort(planned, axis=1, kind='stable')[:, :max(int(running.sum(axis=1).max()), 1)]
+        planned = np.take_along_axis(planned, by_end, axis=1)
+        # Free resources after each release, in order of planned end
+        gain = np.take_along_axis(state['alloc'][env] & running[:, :, None], by_end[:, :, None], axis=1)
+        gain = gain[:, :, None, :] * np.take_along_axis(req[env], by_end[:, :, None], axis=1)[:, :, :, None]
+        later = np.cumsum(gain, axis=1, out=gain)
+        later += state['free'][env][:, None]
+        head_fit = (self.room(later, req[env, head][:, None]) >= need[env, head][:, None]) & (planned < np.iinfo(np.int64).max)
+        shadow = np.where(head_fit.any(axis=1), planned[idx, np.argmax(head_fit, axis=1)], np.iinfo(np.int64).max)
+        # Every job ending by the reservation is released
+        return shadow, later[idx, (planned <= shadow[:, None]).sum(axis=1) - 1]
+
+    def mean_wait(self, tables:list[JobTable], limit:np.ndarray=None) -> np.ndarray:
+        """
+        Mean wait time of every workload, in seconds.
+
+        Args:
+            tables (list[JobTable]): B workloads on the simulator topology
+            limit (np.ndarray, optional): (B, J) time limits replacing the requested walltimes,
+                e.g. the predictions of ActionNet. Defaults to None.
+
+        Returns:
+            np.ndarray: (B,) mean wait (start - submission) of the jobs that ran
+        """
+        B, J = len(tables), max(len(table) for table in tables)
+        columns = {name: np.zeros((B, J), dtype=np.int64)
+                   for name in ('submit', 'limit', 'sim', 'n_tasks', 'tasks_per_node', 'mem', 'gres')}
+        valid = np.zeros((B, J), dtype=bool)
+        for b, table in enumerate(tables):
+            n = len(table)
+            columns['submit'][b, :n] = table.td
+            columns['limit'][b, :n] = table.walltime
+            columns['sim'][b, :n] = table.sim_walltime
+            columns['n_tasks'][b, :n] = table.n_tasks
+            columns['tasks_per_node'][b, :n] = table.tasks_per_node
+            columns['mem'][b, :n] = table.mem
+            columns['gres'][b, :n] = table.gres
+            valid[b, :n] = True
+        if limit is not None:
+            columns['limit'] = np.maximum(np.asarray(limit, dtype=np.int64), 1)
+        sim = columns['sim']
+        # As in the simulator a sim walltime of -1 runs the job until its time limit
+        duration = np.where((sim < 0) | (sim > columns['limit']), columns['limit'], sim)
+        start = self.run(columns['submit'], columns['limit'], duration, columns['n_tasks'],
+                         columns['tasks_per_node'], columns['mem'], columns['gres'], valid)
+        wait = start - np.where(valid, columns['submit'], 0)
+        return np.nanmean(wait, axis=1)
@@ -0,0 +1,344 @@
+import heapq
+import re
+import numpy as np
+
+from datetime import datetime, timezone
+from pathlib import Path
+
+from slurm_topo.node import Node
+from slurm_topo.topology import Topology
+from app.acct import limit_seconds
+from app.utils import node_extract, topology_extract
+
+# Defaults of templates/sim.conf.step and templates/slurm.conf.step
+TIME_START = 1641013200
+DEF_MEM_PER_CPU = 500
+REAL_MEMORY = 48000
+FIRST_JOB_ID = 1001
+
+date_format = "%Y-%m-%dT%H:%M:%S"
+
+ACCT_COLUMNS = ['JobID', 'JobIDRaw', 'Cluster', 'Partition', 'Account', 'User', 'Submit', 'Eligible', 'Start', 'End',
+                'Elapsed', 'State', 'NNodes', 'NCPUS', 'ReqMem', 'ReqTRES', 'Timelimit', 'QOS', 'NodeList', 'JobName']
+
+class SimJob:
+    '''
+    Class SimJob: a job of the simulated workload, with the resources of each of its nodes
+    '''
+
+    def __init__(self, name:str, submit:int, uid:str, account:str, limit:int, sim_walltime:int,
+                 n_tasks:int, tasks_per_node:int, mem:int=0, gres:int=0, features:list[str]=[]):
+        self.name = name
+        self.submit = submit
+        self.uid = uid
+        self.account = account
+        self.limit = limit
+        self.sim_walltime = sim_walltime
+        self.n_tasks = n_tasks
+        self.tasks_per_node = tasks_per_node
+        self.num_nodes = -(-n_tasks // tasks_per_node)
+        self.mem = mem
+        self.gres = gres
+        self.features = features
+        # A sim walltime of -1 runs the job until its time limit
+        self.timeout = sim_walltime < 0 or sim_walltime > limit
+        self.duration = limit if self.timeout else sim_walltime
+        self.job_id = None
+        self.request = None
+        self.eligible = None
+        self.start = None
+        self.end = None
+        self.alloc = None
+
+    def state(self) -> str:
+        return 'TIMEOUT' if self.timeout else 'COMPLETED'
+
+def read_event(line:str, time_start:int=TIME_START) -> SimJob|None:
+    '''
+    SimJob of a submit_batch_job line of an events file, None for other events
+    '''
+    head, _, command = line.partition('|')
+    head = head.split()
+    if '-e' not in head or head[head.index('-e') + 1] != 'submit_batch_job':
+        return None
+    options = {}
+    tokens = command.split()
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token.startswith('--') and '=' in token:
+            key, value = token.split('=', 1)
+            options[key] = value
+        elif token.startswith('-') and i + 1 < len(tokens):
+            options[token] = tokens[i + 1]
+            i += 1
+        i += 1
+    gres = re.search(r'gpu:(?:[^:,]*:)?(\d+)', options.get('--gres', ''))
+    constraint = options.get('--constraint', '')
+    return SimJob(
+        name=options['-J'],
+        submit=time_start + int(head[head.index('-dt') + 1]),
+        uid=options.get('--uid', ''),
+        account=options.get('-A', ''),
+        limit=int(limit_seconds(options['-t'])),
+        sim_walltime=int(options.get('-sim-walltime', -1)),
+        n_tasks=int(options.get('-n', 1)),
+        tasks_per_node=int(options.get('--ntasks-per-node', options.get('-n', 1))),
+        mem=int(options.get('--mem', 0)),
+        gres=int(gres.group(1)) if gres else 0,
+        features=[feat for feat in re.split(r'[&,]', constraint) if feat],
+    )
+
+def read_events(path, time_start:int=TIME_START) -> list[SimJob]:
+    with open(path, mode='r') as f:
+        jobs = [read_event(line, time_start) for line in f if line.strip()]
+    return [job for job in jobs if job is not None]
+
+class Cluster:
+    '''
+    Class Cluster: cores, memory and gpus of every node, as cons_tres tracks them
+    '''
+
+    def __init__(self, nodes:list[Node], def_mem_per_cpu:int=DEF_MEM_PER_CPU):
+        self.def_mem_per_cpu = def_mem_per_cpu
+        self.names = []
+        cores, mem, gpus, features = [], [], [], []
+        for node in sorted(nodes, key=lambda node: node.node_name()):
+            for name in expand_names(node):
+                self.names.append(name)
+                cores.append(node.procs)
+                mem.append(node.memory if node.memory != 0 else REAL_MEMORY)
+                gpus.append(node.gres)
+                features.append(node.features)
+        self.feature_bits = {feat: 1 << i for i, feat in enumerate(sorted(set(f for feats in features for f in feats)))}
+        self.features = np.array([self.feature_mask(feats) for feats in features], dtype=np.int64)
+        self.capacity = np.array([cores, mem, gpus], dtype=np.int64).reshape(3, -1)
+
+    def feature_mask(self, features:list[str]) -> int|None:
+        mask = 0
+        for feat in features:
+            if feat not in self.feature_bits:
+                return None
+            mask |= self.feature_bits[feat]
+        return mask
+
+    def request(self, job:SimJob) -> np.ndarray:
+        '''
+        Cores, memory and gpus the job takes on each of its nodes
+        '''
+        if job.request is None:
+            mem = job.mem if job.mem > 0 else job.tasks_per_node * self.def_mem_per_cpu
+            job.request = np.array([job.tasks_per_node, mem, job.gres], dtype=np.int64)
+            mask = self.feature_mask(job.features)
+            # Nodes providing all the requested features
+            job.eligible = np.zeros(len(self.names), dtype=bool) if mask is None else (self.features & mask) == mask
+        return job.request
+
+    def fit(self, job:SimJob, free:np.ndarray) -> np.ndarray|None:
+        '''
+        First num_nodes nodes able to host the job given the @free resources, None when they are not enough
+        '''
+        request = self.request(job)
+        ok = job.eligible & (free[0] >= request[0]) & (free[1] >= request[1])
+        if request[2] > 0:
+            ok &= free[2] >= request[2]
+        nodes = np.flatnonzero(ok)
+        if len(nodes) < job.num_nodes:
+            return None
+        return nodes[:job.num_nodes]
+
+def expand_names(node:Node) -> list[str]:
+    if isinstance(node.num, (tuple, list)):
+        return [f'{node.name}{i}' for i in range(node.num[0], node.num[1] + 1)]
+    if node.num == 0:
+        return [node.name]
+    return [f'{node.name}{i}' for i in range(1, node.num + 1)]
+
+class Simulator:
+    '''
+    Class Simulator: discrete-event simulation of a workload on a cluster.
+
+    Jobs are queued in submission order (FCFS) and the first job that cannot start gets
+    a reservation at the earliest time the running jobs free enough resources for it (by
+    their time limits). Later jobs are backfilled when they fit now and either end before
+    the reservation or leave enough resources for it (EASY backfill). Nodes are shared
+    between jobs, cores, memory and gpus are accounted per node as with select/cons_tres.
+    Jobs that could not run on the empty cluster are rejected at submission.
+    As with bf_max_job_test, a backfill pass looks at the first @max_job_test queued jobs.
+    '''
+
+    def __init__(self, cluster:Cluster, max_job_test:int=1200):
+        self.cluster = cluster
+        # Queued jobs considered by each backfill pass, as bf_max_job_test
+        self.max_job_test = max_job_test
+
+    def run(self, jobs:list[SimJob]) -> list[SimJob]:
+        """
+        Simulate the workload.
+
+        Args:
+            jobs (list[SimJob]): jobs in submission order
+
+        Returns:
+            list[SimJob]: the jobs that ran, by job id, with their start, end and nodes
+        """
+        self.free = self.cluster.capacity.copy()
+        self.queue = []
+        self.running = []
+        self.rejected = []
+        done = []
+        events = []
+        for i, job in enumerate(jobs):
+            job.job_id = FIRST_JOB_ID + i
+            # Ends (kind 0) are handled before the submissions of the same second
+            heapq.heappush(events, (job.submit, 1, job.job_id, job))
+        while len(events) > 0:
+            now = events[0][0]
+            while len(events) > 0 and events[0][0] == now:
+                _, kind, _, job = heapq.heappop(events)
+                if kind == 0:
+                    self.release(job)
+                    done.append(job)
+                elif self.cluster.fit(job, self.cluster.capacity) is None:
+                    self.rejected.append(job)
+                else:
+                    self.queue.append(job)
+            for job in self.schedule(now):
+                heapq.heappush(events, (job.end, 0, job.job_id, job))
+        done.sort(key=lambda job: job.job_id)
+        return done
+
+    def allocate(self, job:SimJob, nodes:np.ndarray, now:int):
+        job.start = now
+        job.end = now + job.duration
+        job.alloc = nodes
+        self.free[:, nodes] -= self.cluster.request(job)[:, None]
+        self.running.append(job)
+
+    def release(self, job:SimJob):
+        self.free[:, job.alloc] += self.cluster.request(job)[:, None]
+        self.running.remove(job)
+
+    def reservation(self, job:SimJob) -> tuple[int|float, np.ndarray]:
+        '''
+        Earliest start time of @job by the time limits of the running jobs, and the free resources at that time
+        '''
+        free = self.free.copy()
+        shadow = float('inf')
+        for running in sorted(self.running, key=lambda running: running.start + running.limit):
+            end = running.start + running.limit
+            # Every job ending by the reservation is released
+            if end > shadow:
+                break
+            free[:, running.alloc] += self.cluster.request(running)[:, None]
+            if shadow == float('inf') and self.cluster.fit(job, free) is not None:
+                shadow = end
+        return shadow, free
+
+    def schedule(self, now:int) -> list[SimJob]:
+        started = []
+        while len(self.queue) > 0:
+            nodes = self.cluster.fit(self.queue[0], self.free)
+            if nodes is None:
+                break
+            job = self.queue.pop(0)
+            self.allocate(job, nodes, now)
+            started.append(job)
+        if len(self.queue) == 0:
+            return started
+
+        head = self.queue[0]
+        shadow, shadow_free = self.reservation(head)
+        candidates = self.queue[1:self.max_job_test]
+        if len(candidates) == 0:
+            return started
+        # Free resources only shrink during the pass: jobs that do not fit now are never tested again
+        request = np.array([self.cluster.request(job) for job in candidates])
+        eligible = np.array([job.eligible for job in candidates])
+        room = (eligible & (self.free[None] >= request[:, :, None]).all(axis=1)).sum(axis=1)
+        for k in np.flatnonzero(room >= np.array([job.num_nodes for job in candidates])):
+            job = candidates[k]
+            nodes = self.cluster.fit(job, self.free)
+            if nodes is None:
+                continue
+            if now + job.limit > shadow:
+                # Still running at the reservation: the head job must fit in what is left
+                left = shadow_free.copy()
+                left[:, nodes] -= self.cluster.request(job)[:, None]
+                if self.cluster.fit(head, left) is None:
+                    continue
+                shadow_free = left
+            self.allocate(job, nodes, now)
+            started.append(job)
+        if len(started) > 0:
+            self.queue = [job for job in self.queue if job.start is None]
+        return started
+
+def format_time(seconds:int) -> str:
+    days, seconds = divmod(int(seconds), 86400)
+    clock = f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+    return f'{days}-{clock}' if days > 0 else clock
+
+def format_date(epoch:int) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime(date_format)
+
+def write_acct(path, jobs:list[SimJob], cluster:Cluster, name:str='micro'):
+    """
+    Write the simulated jobs as a pipe-separated slurm_acct.out.
+
+    Args:
+        path: output file
+        jobs (list[SimJob]): jobs returned by Simulator.run
+        cluster (Cluster): simulated cluster
+        name (str, optional): cluster name. Defaults to 'micro'.
+    """
+    rows = ['|'.join(ACCT_COLUMNS)]
+    for job in jobs:
+        cores, mem, gpus = cluster.request(job).tolist()
+        ncpus = cores * job.num_nodes
+        tres = f'billing={ncpus},cpu={ncpus},mem={mem * job.num_nodes}M,node={job.num_nodes}'
+        if gpus > 0:
+            tres += f',gres/gpu={gpus * job.num_nodes}'
+        rows.append('|'.join([
+            str(job.job_id), str(job.job_id), name, 'normal', job.account, job.uid,
+            format_date(job.submit), format_date(job.submit), format_date(job.start), format_date(job.end),
+            format_time(job.end - job.start), job.state(), str(job.num_nodes), str(ncpus), f'{mem}M', tres,
+            format_time(job.limit), 'normal', ','.join(cluster.names[i] for i in job.alloc), job.name,
+        ]))
+    with open(path, mode='w') as f:
+        f.write('\n'.join(rows) + '\n')
+
+def read_setting(path:Path, key:str, default):
+    '''
+    Value of a Key=Value (or "export key=value") setting of a configuration file
+    '''
+    if not path.exists():
+        return default
+    with open(path, mode='r') as f:
+        match = re.search(rf'^[^#\n]*\b{key}\s*=\s*([^\s#]+)', f.read(), flags=re.MULTILINE)
+    return type(default)(float(match.group(1))) if match else default
+
+def simulate_env(path:str|Path, topology:Topology=None) -> Simulator:
+    """
+    Simulate the workload of an env directory without slurmsim: reads etc/, start.sh and
+    workload/first_job.events and writes results/slurm_acct.out.
+
+    Args:
+        path (str | Path): env directory
+        topology (Topology, optional): cluster topology. Defaults to the one of etc/slurm.conf.
+
+    Returns:
+        Simulator: the simulator, with the rejected jobs
+    """
+    path = path if isinstance(path, Path) else Path(path)
+    if topology is None:
+        nodes = node_extract(path / 'etc/slurm.conf')
+        topology = topology_extract(path / 'etc/topology.conf', nodes)
+    time_start = read_setting(path / 'etc/sim.conf', 'TimeStart', TIME_START) + read_setting(path / 'start.sh', 'dtstart', 0)
+    def_mem_per_cpu = read_setting(path / 'etc/slurm.conf', 'DefMemPerCPU', DEF_MEM_PER_CPU)
+    cluster = Cluster(topology.nodes, def_mem_per_cpu)
+    simulator = Simulator(cluster)
+    jobs = simulator.run(read_events(path / 'workload/first_job.events', time_start))
+    (path / 'results').mkdir(exist_ok=True)
+    write_acct(path / 'results/slurm_acct.out', jobs, cluster)
+    return simulator
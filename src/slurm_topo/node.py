@@ -1,4 +1,4 @@
-import numpy.random as rnd
+import numpy as np
 import re
 
 FEATURES = ['BigMem', 'ManyCores']
@@ -79,7 +79,10 @@ class NodeGenerator(object):
     '''
     Class NodeGenerator: Random Computing Node generator
     '''
-    def __init__(self, min_proc:int=0, max_proc:int=7, min_mem:int=6, max_mem:int=33, min_sock:int=1, max_sock:int=3, min_gres:int=1, max_gres:int=9, **kwargs):
+    def __init__(self, min_proc:int=0, max_proc:int=7, min_mem:int=6, max_mem:int=33, min_sock:int=1, max_sock:int=3, min_gres:int=1, max_gres:int=9,
+                 rng:np.random.Generator=None, **kwargs):
+        # Random stream of every draw, see set_rng
+        self.rng = np.random.default_rng() if rng is None else rng
         self.min_proc = min_proc
         self.max_proc = max_proc
         self.min_mem = min_mem
@@ -96,30 +99,33 @@ class NodeGenerator(object):
 
 
     def set_seed(self, seed:int):
-        rnd.seed(seed)
+        self.set_rng(np.random.default_rng(seed))
+
+    def set_rng(self, rng:np.random.Generator):
+        self.rng = rng
 
     def generate_sockets(self, bot, top, num):
-        ret = rnd.randint(bot, top)
+        ret = int(self.rng.integers(bot, top))
         ret -= (num % ret)
         return ret
 
     def generate_node(self, name:str, num:int|tuple[int], features:list=[], big_mem:bool=False, gpu:bool=False, many_cores:bool=False):
         if many_cores:
-            procs = rnd.randint(self.many_min_proc, self.many_max_proc)
+            procs = int(self.rng.integers(self.many_min_proc, self.many_max_proc))
             features.append('ManyCores')
         else:
-            procs = rnd.randint(self.min_proc, self.max_proc)
+            procs = int(self.rng.integers(self.min_proc, self.max_proc))
         procs = 1 if procs == 0 else procs * 4
         sockets = self.generate_sockets(self.min_sock, self.max_sock, procs)
         if big_mem:
-            memory = rnd.randint(self.big_min_mem, self.big_max_mem)
+            memory = int(self.rng.integers(self.big_min_mem, self.big_max_mem))
             features.append('BigMem')
         else:
-            memory = rnd.randint(self.min_mem, self.max_mem)
+            memory = int(self.rng.integers(self.min_mem, self.max_mem))
         memory *= 4000
         if not gpu:
             return Node(name, procs, sockets, num, memory, features=features)
-        gres = rnd.randint(self.min_gres, self.max_gres)
+        gres = int(self.rng.integers(self.min_gres, self.max_gres))
         return Node(name, procs, sockets, num, memory, gres=gres, features=features)
     
 def node_parser(line:str) -> dict:
@@ -1,5 +1,6 @@
 from slurm_topo.node import Node, NodeGenerator
-import numpy.random as rnd
+from bisect import bisect_left
+import numpy as np
 
 FEATURES = ['BigMem', 'ManyCores']
 
@@ -44,6 +45,7 @@ class Topology:
         self.max_gres = max_gres
         self.partitions = []
         self.qos = []
+        self.build_index()
 
     def concatenate_list(self, topo_list:list):
         res = []
@@ -54,25 +56,95 @@ class Topology:
                 res.append(e)
         return res
     
+    def build_index(self):
+        '''
+        Build the resource index used by count_nodes: the distinct gres, procs and
+        memory values sorted in ascending order, a feature bitmask for every node
+        and, lazily for each constraint set, a table of cumulative node counts.
+        '''
+        all_features = sorted(set(feat for node in self.nodes for feat in node.features))
+        self.feature_bits = {feat: 1 << i for i, feat in enumerate(all_features)}
+        self.node_gres = np.array([node.gres for node in self.nodes], dtype=np.int64)
+        self.node_procs = np.array([node.procs for node in self.nodes], dtype=np.int64)
+        self.node_mem = np.array([node.memory for node in self.nodes], dtype=np.int64)
+        self.node_num = np.array([node.cum_number for node in self.nodes], dtype=np.int64)
+        self.node_mask = [self.feature_mask(node.features) for node in self.nodes]
+        self.gres_values = np.unique(self.node_gres)
+        self.procs_values = np.unique(self.node_procs)
+        self.mem_values = np.unique(self.node_mem)
+        self.gres_list = self.gres_values.tolist()
+        self.procs_list = self.procs_values.tolist()
+        self.mem_list = self.mem_values.tolist()
+        self.count_tables = {}
+
+    def feature_mask(self, features) -> int|None:
+        '''
+        Bitmask of a feature set, None when a feature is not provided by any node
+        '''
+        mask = 0
+        for feat in features:
+            if feat not in self.feature_bits:
+                return None
+            mask |= self.feature_bits[feat]
+        return mask
+
+    def count_table(self, mask:int) -> np.ndarray:
+        '''
+        table[g, p, m]: number of nodes with all the features in mask and at least
+        gres_values[g] gpus, procs_values[p] procs and mem_values[m] memory.
+        The last entry of every axis is 0, for requests above the maximum value.
+        '''
+        if mask in self.count_tables:
+            return self.count_tables[mask]
+        table = np.zeros((len(self.gres_values) + 1, len(self.procs_values) + 1, len(self.mem_values) + 1), dtype=np.int64)
+        match = np.array([(node_mask & mask) == mask for node_mask in self.node_mask], dtype=bool)
+        g = np.searchsorted(self.gres_values, self.node_gres[match])
+        p = np.searchsorted(self.procs_values, self.node_procs[match])
+        m = np.searchsorted(self.mem_values, self.node_mem[match])
+        np.add.at(table, (g, p, m), self.node_num[match])
+        for axis in range(3):
+            table = np.flip(np.cumsum(np.flip(table, axis), axis=axis), axis)
+        self.count_tables[mask] = table
+        return table
+
+    def count_nodes_batch(self, gres=0, procs=0, mem=0, costraints:set={}) -> np.ndarray:
+        '''
+        Vectorized count_nodes: gres, procs and mem can be arrays (broadcasted together),
+        every requirement is answered with three binary searches on the resource index.
+        '''
+        gres, procs, mem = np.broadcast_arrays(np.asarray(gres), np.asarray(procs), np.asarray(mem))
+        mask = self.feature_mask(costraints)
+        if mask is None:
+            return np.zeros(gres.shape, dtype=np.int64)
+        table = self.count_table(mask)
+        g = np.searchsorted(self.gres_values, gres)
+        p = np.searchsorted(self.procs_values, procs)
+        m = np.searchsorted(self.mem_values, mem)
+        return table[g, p, m]
+
     def count_nodes(self, gres=0, procs=0, mem=0, costraints:set={}):
-        node_number = 0
-        for node in self.nodes:
-            if node.gres < gres or node.procs < procs or node.memory < mem:
-                continue
-            prop = set(node.features)
-            if len(costraints) != 0 and not costraints.issubset(prop):
-                continue
-            node_number += node.cum_number
-        return node_number
+        mask = self.feature_mask(costraints)
+        if mask is None:
+            return 0
+        table = self.count_table(mask)
+        g = bisect_left(self.gres_list, gres)
+        p = bisect_left(self.procs_list, procs)
+        m = bisect_left(self.mem_list, mem)
+        return int(table[g, p, m])
     
 class TopologyGenerator(object):
     '''
     Class TopologyGenerator: A simple topology generator
     '''
 
-    def __init__(self, min_size=4, max_size=8, node_gen=NodeGenerator(), **kwargs):
+    def __init__(self, min_size=4, max_size=8, node_gen=NodeGenerator(), rng:np.random.Generator=None, **kwargs):
         #Add some probability
         self.node_gen = node_gen
+        # A single stream for the groups and their nodes, the one of node_gen unless given
+        if rng is not None:
+            self.set_rng(rng)
+        else:
+            self.rng = node_gen.rng
         self.min_size = min_size
         self.max_size = max_size
         self.gpu = 0.3
@@ -99,13 +171,20 @@ class TopologyGenerator(object):
         else:
             return chr(ord(c) + 1)
 
+    def set_seed(self, seed:int):
+        self.set_rng(np.random.default_rng(seed))
+
+    def set_rng(self, rng:np.random.Generator):
+        self.rng = rng
+        self.node_gen.set_rng(rng)
+
     def randomize_param(self):
         for k in self.param_dict.keys():
-            self.param_dict[k] = rnd.choice([True, False])
+            self.param_dict[k] = bool(self.rng.choice([True, False]))
     
     def group_gen(self):
-        node_number = rnd.randint(self.min_size, self.max_size)
-        p = rnd.rand()
+        node_number = int(self.rng.integers(self.min_size, self.max_size))
+        p = self.rng.random()
         if p < self.gpu:
             return self.node_gen.generate_node(name=self.c, num=node_number, features=[f'CPU-{self.c.capitalize()}'], gpu=True)
         elif p < self.many_cores:
@@ -1,98 +1,267 @@
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler, Subset
 from pathlib import Path
 
-import pandas as pd
-from datetime import datetime, timedelta
-
 from app.utils import vectorize_job
+from app.acct import read_acct, mean_wait
+
+from train.events import extract_flags, parse_events, parse_events_batch
+from train.shard import Shard, write_shard, INDEX
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 
+import json
 import os
-import re
 
 
 date_format = "%Y-%m-%dT%H:%M:%S"
+# Below this number of files labels are computed in process
+PARALLEL_MIN = 4096
+LABEL_CACHE = ".label_cache.json"
 
-def time_second(s:str):
-    hour, minute, second = s.split(':')
-    return int(hour) * 3600 + int(minute) * 60 + int(second)
-
-def extract_flags(job:str):
-    patterns = {
-    "-t": r"-t\s+([0-9:]+)",
-    "-n": r"-n\s+(\d+)",
-    "--ntasks-per-node": r"--ntasks-per-node[=\s]+(\d+)",
-    "--gres": r"--gres[=\s]gpu:+([^\s]+)",
-    "--mem": r"--mem[=\s]+(\d+)"
-    }
-
-    index = {
-    "-t": 4,
-    "-n": 0,
-    "--ntasks-per-node": 1,
-    "--gres": 3,
-    "--mem": 2
-    }
-
-    results = [0] * 5
-
-    for key, pat in patterns.items():
-        match = re.search(pat, job)
-        i = index[key]
-        if match:
-            if key == '-t':
-                results[i] = time_second(match.group(1)) / 3600
-            else:
-                results[i] = int(match.group(1))
-        else:
-            results[i] = 0   # default when missing
-    return results
+def wait_hours(loc) -> float:
+    return mean_wait(loc) / 3600
 
 def reward_calculation(loc:str="/home/ago/tesi/slurm_ai_sched/src/tests/saved/slurm_dataset/env_0/results/slurm_acct.out", p=False):
-    executed_time = 0
-    wait_time = 0
-    data = pd.read_csv(loc, sep='|', header=0)
-    eligible = data['Eligible'].apply(lambda x : datetime.strptime(x, date_format))
-    start = data['Start'].apply(lambda x : datetime.strptime(x, date_format))
-    wait_time = start - eligible
     if p:
-        print(eligible)
-        print(start)
-        print(wait_time)
-    wait_time = wait_time.apply(lambda x : x.total_seconds() / (3600)).mean()
-    return torch.tensor(wait_time, dtype=torch.float32)
+        acct = read_acct(loc)
+        print(acct.eligible)
+        print(acct.start)
+        print(acct.wait())
+    return torch.tensor(wait_hours(loc), dtype=torch.float32)
+
+class LabelCache:
+    '''
+    Class LabelCache: persistent labels of slurm_acct.out files, valid while path, size and mtime match
+    '''
+
+    def __init__(self, path:str|Path):
+        self.path = path if isinstance(path, Path) else Path(path)
+        self.entries = {}
+        if self.path.exists():
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)
+        self.dirty = False
+
+    @staticmethod
+    def key(loc) -> tuple[str, list[int]]:
+        stat = os.stat(loc)
+        return str(loc), [stat.st_size, stat.st_mtime_ns]
+
+    def get(self, loc) -> float|None:
+        name, signature = self.key(loc)
+        entry = self.entries.get(name)
+        if entry is None or entry[:2] != signature:
+            return None
+        return entry[2]
+
+    def put(self, loc, label:float):
+        name, signature = self.key(loc)
+        self.entries[name] = signature + [label]
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+def extract_labels(locations:list, workers:int=None, cache:str|Path=None) -> np.ndarray:
+    """
+    Labels (mean wait hours) of many slurm_acct.out files.
+
+    Args:
+        locations (list): slurm_acct.out files
+        workers (int, optional): size of the process pool. Defaults to the number of cpus.
+        cache (str | Path, optional): label cache file, see LabelCache. Defaults to None (no cache).
+
+    Returns:
+        np.ndarray: float32 labels, one for every location
+    """
+    labels = np.empty(len(locations), dtype=np.float32)
+    label_cache = LabelCache(cache) if cache is not None else None
+    missing = []
+    for i, loc in enumerate(locations):
+        label = label_cache.get(loc) if label_cache is not None else None
+        if label is None:
+            missing.append(i)
+        else:
+            labels[i] = label
+    todo = [locations[i] for i in missing]
+    workers = os.cpu_count() if workers is None else workers
+    if workers > 1 and len(todo) >= PARALLEL_MIN:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            values = list(pool.map(wait_hours, todo, chunksize=max(1, len(todo) // (workers * 4))))
+    else:
+        values = [wait_hours(loc) for loc in todo]
+    for i, value in zip(missing, values):
+        labels[i] = value
+        if label_cache is not None:
+            label_cache.put(locations[i], float(value))
+    if label_cache is not None:
+        label_cache.save()
+    return labels
+
+def compile_shard(path:str|Path, shard:str|Path, chunk_size:int=4096):
+    """
+    Pack the workloads and labels of the env directories in @path into a shard.
+    If the shard already exists only the directories it does not hold yet are added.
+
+    Args:
+        path (str | Path): dataset directory, one env directory for each sample
+        shard (str | Path): shard directory
+        chunk_size (int, optional): env directories for each shard part. Defaults to 4096.
+    """
+    path = path if isinstance(path, Path) else Path(path)
+    shard = shard if isinstance(shard, Path) else Path(shard)
+    done = set(Shard(shard).names) if (shard / INDEX).exists() else set()
+    elements = sorted(entry.name for entry in os.scandir(path) if entry.is_dir() and entry.name not in done)
+    for i in range(0, len(elements), chunk_size):
+        chunk = elements[i:i + chunk_size]
+        data, offsets = parse_events_batch([path / dir_name / "workload/first_job.events" for dir_name in chunk])
+        labels = extract_labels([path / dir_name / "results/slurm_acct.out" for dir_name in chunk])
+        write_shard(shard, chunk, data, offsets, labels)
 
 class SlurmDataset(Dataset):
-    def __init__(self, path:str|Path, max_i=-1):
+    def __init__(self, path:str|Path, max_i=-1, shard:str|Path=None, workers:int=None, cache:str|Path=None):
         super().__init__()
         self.path = path if isinstance(path, Path) else Path(path)
-        self.elements = os.listdir(path)
-        self.elements.sort()
-        self.labels = self.extract_label()
+        self.shard = None
+        if shard is not None:
+            # Samples are served from the memory-mapped shard, see compile_shard
+            self.shard = Shard(shard)
+            self.elements = list(self.shard.names)
+            self.labels = torch.from_numpy(self.shard.labels)
+        else:
+            self.elements = [entry.name for entry in os.scandir(path) if entry.is_dir()]
+            self.elements.sort()
+            self.workers = workers
+            # Labels are cached next to the env directories by default
+            self.cache = self.path / LABEL_CACHE if cache is None else cache
+            self.labels = self.extract_label()
         self.max_i = max_i 
     
+    def lengths(self) -> np.ndarray:
+        '''
+        Number of jobs of every sample, without parsing the workloads
+        '''
+        if self.shard is not None:
+            return self.shard.length.copy()
+        lengths = np.empty(len(self.elements), dtype=np.int64)
+        for i, dir_name in enumerate(self.elements):
+            with open(self.path / dir_name / "workload/first_job.events", mode='rb') as f:
+                raw = f.read()
+            lengths[i] = raw.count(b'\n') + (len(raw) > 0 and raw[-1:] != b'\n')
+        return lengths
+
     def extract_label(self):
-        labels = []
-        for dir_name in self.elements:
-            dir_name = Path(dir_name) / "results/slurm_acct.out"
-            loc = self.path / dir_name
-            label = reward_calculation(loc)
-            labels.append(label)
-        return labels
+        locations = [self.path / dir_name / "results/slurm_acct.out" for dir_name in self.elements]
+        return torch.from_numpy(extract_labels(locations, self.workers, self.cache))
     
     def __getitem__(self, index):
+        if self.shard is not None:
+            data, _ = self.shard[index]
+            return torch.from_numpy(data), self.labels[index]
         location = Path(self.elements[index]) / "workload/first_job.events"
         location = self.path / location
-        with open(location) as f:
-            data = [extract_flags(line) for line in f]
+        data = torch.from_numpy(parse_events(location))
         label = self.labels[index]
-        data = torch.tensor(data, dtype=torch.float32)
         return data, label
     
     def __len__(self):
         return len(self.elements) if self.max_i == -1 else self.max_i
 
-    
+
+def dataset_lengths(dataset:Dataset) -> np.ndarray:
+    '''
+    Number of jobs of every sample of a SlurmDataset or of a Subset of it (e.g. from random_split)
+    '''
+    if isinstance(dataset, Subset):
+        return dataset_lengths(dataset.dataset)[np.asarray(dataset.indices)]
+    return dataset.lengths()[:len(dataset)]
+
+class BucketBatchSampler(Sampler):
+    '''
+    Class BucketBatchSampler: batches of workloads with similar number of jobs.
+
+    Every epoch the samples are shuffled, split in pools of @pool_batches batches and
+    sorted by length inside each pool, so a batch pads its workloads to a close length.
+    Batches hold at most @batch_size samples and, when @max_jobs is set, at most
+    @max_jobs padded rows (batch length * longest workload): a batch of 10 jobs workloads
+    and one of 10000 jobs workloads cost the same memory. The batch order is shuffled.
+    With @drop_last only the last batch of a pool is dropped, when it has room for
+    another sample of its longest length.
+    '''
+
+    def __init__(self, lengths:np.ndarray, batch_size:int, max_jobs:int=None, pool_batches:int=64,
+                 shuffle:bool=True, drop_last:bool=False, seed:int=None):
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.batch_size = batch_size
+        self.max_jobs = max_jobs
+        self.pool_batches = pool_batches
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.rng = np.random.default_rng(seed)
+        self.batches = self.make_batches()
+        # Whether self.batches were already handed out by __iter__
+        self.used = False
+
+    def make_batches(self) -> list[np.ndarray]:
+        order = self.rng.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+        pool = self.batch_size * self.pool_batches
+        batches = []
+        for i in range(0, len(order), pool):
+            chunk = order[i:i + pool]
+            chunk = chunk[np.argsort(self.lengths[chunk], kind='stable')]
+            start = 0
+            while start < len(chunk):
+                stop = min(start + self.batch_size, len(chunk))
+                if self.max_jobs is not None:
+                    # Sorted chunk: the last sample is the longest, the batch stops when the padded size exceeds max_jobs
+                    padded = self.lengths[chunk[start:stop]] * np.arange(1, stop - start + 1)
+                    stop = start + max(1, int(np.searchsorted(padded, self.max_jobs, side='right')))
+                batch = chunk[start:stop]
+                # Only the end of the pool can cut a batch before batch_size or max_jobs do
+                full = len(batch) == self.batch_size or (self.max_jobs is not None and self.lengths[batch[-1]] * (len(batch) + 1) > self.max_jobs)
+                if not self.drop_last or stop < len(chunk) or full:
+                    batches.append(batch)
+                start = stop
+        if self.shuffle:
+            batches = [batches[i] for i in self.rng.permutation(len(batches))]
+        return batches
+
+    def __iter__(self):
+        # A new epoch draws its batches as it starts, __len__ counts the ones being iterated
+        if self.used:
+            self.batches = self.make_batches()
+        self.used = True
+        return (batch.tolist() for batch in self.batches)
+
+    def __len__(self) -> int:
+        return len(self.batches)
+
+def pad_collate(batch:list[tuple[torch.Tensor, torch.Tensor]]) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    Collate workloads of different lengths, padded with zeros to the longest one.
+
+    Args:
+        batch (list[tuple[torch.Tensor, torch.Tensor]]): (n_jobs, 5) workloads and their labels
+
+    Returns:
+        tuple[torch.Tensor, torch.Tensor, torch.Tensor]: (B, L, 5) inputs, (B, L) bool mask,
+            True on the padded rows (key_padding_mask of nn.MultiheadAttention), and (B,) labels
+    """
+    lengths = torch.tensor([len(data) for data, _ in batch])
+    inputs = torch.nn.utils.rnn.pad_sequence([data for data, _ in batch], batch_first=True)
+    mask = torch.arange(inputs.size(1))[None, :] >= lengths[:, None]
+    labels = torch.stack([torch.as_tensor(label) for _, label in batch])
+    return inputs, mask, labels
+
 if __name__ == '__main__':
     data = SlurmDataset("/home/ago/tesi/slurm_ai_sched/src/tests/saved/slurm_dataset")
     for i in range(5):
@@ -0,0 +1,129 @@
+import numpy as np
+import re
+
+def time_second(s:str):
+    hour, minute, second = s.split(':')
+    return int(hour) * 3600 + int(minute) * 60 + int(second)
+
+def extract_flags(job:str):
+    patterns = {
+    "-t": r"-t\s+([0-9:]+)",
+    "-n": r"-n\s+(\d+)",
+    "--ntasks-per-node": r"--ntasks-per-node[=\s]+(\d+)",
+    "--gres": r"--gres[=\s]gpu:+([^\s]+)",
+    "--mem": r"--mem[=\s]+(\d+)"
+    }
+
+    index = {
+    "-t": 4,
+    "-n": 0,
+    "--ntasks-per-node": 1,
+    "--gres": 3,
+    "--mem": 2
+    }
+
+    results = [0] * 5
+
+    for key, pat in patterns.items():
+        match = re.search(pat, job)
+        i = index[key]
+        if match:
+            if key == '-t':
+                results[i] = time_second(match.group(1)) / 3600
+            else:
+                results[i] = int(match.group(1))
+        else:
+            results[i] = 0   # default when missing
+    return results
+
+# A submit_batch_job line as written by slurm_load.utils.print_events
+EVENT_RX = re.compile(
+    r'^-dt \d+ -e submit_batch_job \| -J \S+ -sim-walltime -?\d+ --uid=\S+ '
+    r'-t (\d+):(\d+):(\d+) -n (\d+) --ntasks-per-node=(\d+)'
+    r'(?: -A \S+)? -p \S+ -q \S+(?: --constraint=\S+)?(?: --mem=(\d+))?(?: --gres=gpu:(\d+))? pseudo\.job\r?$',
+    flags=re.MULTILINE
+)
+
+def features(match:tuple) -> tuple:
+    '''
+    extract_flags values of an EVENT_RX match
+    '''
+    hour, minute, second, n_tasks, tasks_node, mem, gres = match
+    return int(n_tasks), int(tasks_node), int(mem or 0), int(gres or 0), (int(hour) * 3600 + int(minute) * 60 + int(second)) / 3600
+
+def unambiguous(text:str, matches:list) -> bool:
+    '''
+    Whether the EVENT_RX matches of the lines of @text are the first matches of extract_flags:
+    no other -t, -n, --mem or --gres it could find first
+    '''
+    return (text.count('-t') == len(matches) and text.count('-n') == 3 * len(matches)
+            and text.count('-m') == sum(1 for match in matches if match[5]) and text.count('-g') == sum(1 for match in matches if match[6]))
+
+def parse_line(line:str) -> tuple:
+    '''
+    extract_flags of a single line, through EVENT_RX when it has the layout of print_events
+    '''
+    match = EVENT_RX.fullmatch(line)
+    if match is not None and unambiguous(line, [match.groups()]):
+        return features(match.groups())
+    return extract_flags(line)
+
+def parse_events_buffer(raw:bytes) -> np.ndarray:
+    """
+    Tokenize the content of an events file with a single regex over the whole text,
+    lines in another layout fall back to extract_flags.
+
+    Args:
+        raw (bytes): events file content
+
+    Returns:
+        np.ndarray: (n_jobs, 5) float32 array, same values of extract_flags applied to every line
+    """
+    text = raw.decode()
+    lines = text.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    if len(lines) == 0:
+        return np.zeros((0, 5), dtype=np.float32)
+    matches = EVENT_RX.findall(text)
+    if len(matches) == len(lines) and unambiguous(text, matches):
+        rows = [features(match) for match in matches]
+    else:
+        rows = [parse_line(line) for line in lines]
+    return np.array(rows, dtype=np.float32)
+
+def parse_events(path) -> np.ndarray:
+    """
+    Parse a first_job.events file.
+
+    Args:
+        path: events file location
+
+    Returns:
+        np.ndarray: (n_jobs, 5) float32 array, same values of extract_flags applied to every line
+    """
+    with open(path, mode='rb') as f:
+        return parse_events_buffer(f.read())
+
+def parse_events_batch(paths:list) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Parse many events files.
+
+    Args:
+        paths (list): events files locations
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: the (total_jobs, 5) float32 features of all the files,
+            stacked, and the int64 offsets (len(paths) + 1) of every file inside them
+    """
+    # All the files are tokenized together, each one terminated by a newline
+    contents = []
+    for path in paths:
+        with open(path, mode='rb') as f:
+            raw = f.read()
+        if len(raw) > 0 and raw[-1:] != b'\n':
+            raw += b'\n'
+        contents.append(raw)
+    offsets = np.zeros(len(contents) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([content.count(b'\n') for content in contents])
+    return parse_events_buffer(b''.join(contents)), offsets
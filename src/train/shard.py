@@ -0,0 +1,80 @@
+import numpy as np
+import os
+
+from pathlib import Path
+
+INDEX = 'index.npz'
+
+def part_name(i:int) -> str:
+    return f'part_{i:05d}.npy'
+
+class Shard:
+    '''
+    Class Shard: preprocessed workloads, memory-mapped from disk.
+
+    A shard directory holds one or more flat float32 parts (part_xxxxx.npy, shape (rows, 5))
+    and an index.npz with, for every sample, its name, part, first row, number of rows and label.
+    '''
+
+    def __init__(self, path:str|Path):
+        self.path = path if isinstance(path, Path) else Path(path)
+        with np.load(self.path / INDEX) as index:
+            self.names = index['names']
+            self.part = index['part']
+            self.start = index['start']
+            self.length = index['length']
+            self.labels = index['labels']
+        self.parts = {}
+
+    def data(self, part:int) -> np.ndarray:
+        # Copy-on-write mapping: writable for torch.from_numpy, but nothing is copied until written
+        if part not in self.parts:
+            self.parts[part] = np.load(self.path / part_name(part), mmap_mode='c')
+        return self.parts[part]
+
+    def __getitem__(self, index:int) -> tuple[np.ndarray, np.float32]:
+        start = self.start[index]
+        data = self.data(self.part[index])[start:start + self.length[index]]
+        return data, self.labels[index]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+def write_shard(path:str|Path, names:list[str], data:np.ndarray, offsets:np.ndarray, labels:np.ndarray):
+    """
+    Store a batch of samples in a shard, as a new part.
+    The shard is created when missing, otherwise the samples are appended to it.
+
+    Args:
+        path (str | Path): shard directory
+        names (list[str]): sample names
+        data (np.ndarray): (rows, 5) features of all the samples, stacked
+        offsets (np.ndarray): len(names) + 1 offsets of every sample inside data
+        labels (np.ndarray): one label for every sample
+    """
+    path = path if isinstance(path, Path) else Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    if (path / INDEX).exists():
+        with np.load(path / INDEX) as index:
+            old = {k: index[k] for k in index.files}
+        part = int(old['part'].max()) + 1 if len(old['part']) > 0 else 0
+    else:
+        old = None
+        part = 0
+
+    np.save(path / part_name(part), np.ascontiguousarray(data, dtype=np.float32))
+    new = {
+        'names': np.asarray(names, dtype=str),
+        'part': np.full(len(names), part, dtype=np.int32),
+        'start': np.asarray(offsets[:-1], dtype=np.int64),
+        'length': np.diff(offsets).astype(np.int64),
+        'labels': np.asarray(labels, dtype=np.float32),
+    }
+    if old is not None:
+        new = {k: np.concatenate([old[k], v]) for k, v in new.items()}
+
+    # The index is replaced atomically: readers see either the old or the new samples
+    tmp = path / (INDEX + '.tmp')
+    with open(tmp, 'wb') as f:
+        np.savez(f, **new)
+    os.replace(tmp, path / INDEX)
@@ -1,5 +1,5 @@
 import torch
-from train.data import SlurmDataset
+from train.data import SlurmDataset, BucketBatchSampler, dataset_lengths, pad_collate
 from torch.utils.data import DataLoader
 
 from models.rl_models import QNet, SlurmNet
@@ -20,6 +20,8 @@ def init_modules(module):
 
 TRAIN_STEP = 10000
 BATCH_SIZE = 64
+# Padded jobs in a batch: long workloads get smaller batches
+MAX_JOBS = 64 * 512
 L_RATE = 0.00005
 EPOCHS = 100
 HIDDEN_DIM = 2048
@@ -48,8 +50,10 @@ print(len(data))
 
 train_set, val_set = torch.utils.data.random_split(data,[0.8, 0.2])
 
-train_loader = DataLoader(train_set, batch_size=BATCH_SIZE, shuffle=True, num_workers=4)
-val_loader = DataLoader(val_set, batch_size=BATCH_SIZE, shuffle=True, num_workers=4)
+train_sampler = BucketBatchSampler(dataset_lengths(train_set), BATCH_SIZE, max_jobs=MAX_JOBS)
+val_sampler = BucketBatchSampler(dataset_lengths(val_set), BATCH_SIZE, max_jobs=MAX_JOBS)
+train_loader = DataLoader(train_set, batch_sampler=train_sampler, collate_fn=pad_collate, num_workers=4)
+val_loader = DataLoader(val_set, batch_sampler=val_sampler, collate_fn=pad_collate, num_workers=4)
 
 model = QNet(
     input_dim=5,
@@ -61,7 +65,7 @@ model = QNet(
 
 model = SlurmNet(
     input_dim=5,
-    mid_dim=16,
+    mid_dim=None,
     output_dim=1,
     hidden_dim=HIDDEN_DIM,
     depth_first=DEPTH,
@@ -83,9 +87,10 @@ def train_one_epoch(epoch_index):
     running_loss = 0.
     last_loss = 0.
     for i, data in enumerate(train_loader):
-        # Every data instance is an input + label pair
-        inputs, labels = data
+        # Every data instance is an input, its padding mask and the label
+        inputs, mask, labels = data
         inputs = inputs.to(device)
+        mask = mask.to(device)
         labels = labels.to(device)
         labels = labels.unsqueeze(-1)
 
@@ -93,7 +98,7 @@ def train_one_epoch(epoch_index):
         optimizer.zero_grad()
 
         # Make predictions for this batch
-        outputs = model(inputs)
+        outputs = model(inputs, mask)
 
         # Compute the loss and its gradients
         loss = loss_fn(outputs, labels)
@@ -115,12 +120,13 @@ def validate(epoch_index):
     last_loss = 0.
     model_ = model.eval()
     for i, data in enumerate(val_loader):
-        inputs, labels = data
+        inputs, mask, labels = data
         inputs = inputs.to(device)
+        mask = mask.to(device)
         labels = labels.to(device)
         labels = labels.unsqueeze(-1)
         with torch.no_grad():
-            outputs = model_(inputs)
+            outputs = model_(inputs, mask)
             loss = loss_fn(outputs, labels)
 
         # Gather data and report
@@ -140,9 +146,10 @@ for epoch in range(EPOCHS):
             run.log({"val_loss":val_loss}, step=epoch)
 
 for i, data in enumerate(train_loader):
-        # Every data instance is an input + label pair
-        inputs, labels = data
+        # Every data instance is an input, its padding mask and the label
+        inputs, mask, labels = data
         inputs = inputs.to(device)
+        mask = mask.to(device)
         labels = labels.to(device)
         labels = labels.unsqueeze(-1)
         
@@ -151,7 +158,7 @@ for i, data in enumerate(train_loader):
         optimizer.zero_grad()
 
         # Make predictions for this batch
-        outputs = model(inputs)
+        outputs = model(inputs, mask)
 
         # Compute the loss and its gradients
         loss = loss_fn(outputs, labels)